@@ -1,127 +1,48 @@
 import streamlit as st
-import json
 import os
+import threading
 from datetime import datetime, timedelta
 
-class VolunteerActivityMatcher:
-    def __init__(self):
-        self.data_file = "volunteer_data.json"
-        self.data = self._load_data()
-        
-    def _load_data(self):
-        """加载或初始化数据文件"""
-        if os.path.exists(self.data_file):
-            try:
-                with open(self.data_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception:
-                st.error("数据文件损坏，将创建新文件")
-        return {"users": [], "activities": []}
-    
-    def _save_data(self):
-        """保存数据到文件"""
-        with open(self.data_file, 'w', encoding='utf-8') as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=2)
-    
-    def add_activity(self, name, category, location, date, time_range, description):
-        """添加志愿活动"""
-        activity = {
-            "id": len(self.data["activities"]) + 1,
-            "name": name,
-            "category": category,
-            "location": location,
-            "date": date,
-            "time_range": time_range,
-            "description": description,
-            "participants": []
-        }
-        self.data["activities"].append(activity)
-        self._save_data()
-        return activity
-    
-    def register_user(self, name, location, preferred_categories, available_days):
-        """注册用户"""
-        user = {
-            "id": len(self.data["users"]) + 1,
-            "name": name,
-            "location": location,
-            "preferred_categories": preferred_categories,
-            "available_days": available_days,
-            "registered_activities": []
-        }
-        self.data["users"].append(user)
-        self._save_data()
-        return user
-    
-    def match_activities(self, user_id):
-        """为用户匹配合适的活动"""
-        user = next((u for u in self.data["users"] if u["id"] == user_id), None)
-        if not user:
-            return []
-        
-        matched = []
-        for activity in self.data["activities"]:
-            # 检查日期是否在用户可用时间内
-            activity_day = datetime.strptime(activity["date"], "%Y-%m-%d").strftime("%A")
-            
-            # 简化星期匹配逻辑，支持中文和英文星期
-            day_matched = False
-            for user_day in user["available_days"]:
-                if user_day.lower() in activity_day.lower():
-                    day_matched = True
-                    break
-                # 处理中文星期
-                chinese_days = {
-                    "周一": "Monday", "周二": "Tuesday", "周三": "Wednesday",
-                    "周四": "Thursday", "周五": "Friday", "周六": "Saturday", "周日": "Sunday"
-                }
-                if user_day in chinese_days and chinese_days[user_day].lower() in activity_day.lower():
-                    day_matched = True
-                    break
-            
-            # 检查活动类型是否是用户偏好
-            category_matched = activity["category"] in user["preferred_categories"]
-            
-            # 检查地点是否匹配
-            location_matched = activity["location"] == user["location"]
-            
-            # 匹配逻辑调整：放宽条件，只要时间匹配且满足类型或地点其中之一即可
-            if day_matched and (category_matched or location_matched):
-                matched.append(activity)
-        
-        return matched
-    
-    def register_for_activity(self, user_id, activity_id):
-        """报名参加活动"""
-        user = next((u for u in self.data["users"] if u["id"] == user_id), None)
-        activity = next((a for a in self.data["activities"] if a["id"] == activity_id), None)
-        
-        if not user:
-            return "用户不存在"
-        if not activity:
-            return "活动不存在"
-        if activity_id in user["registered_activities"]:
-            return "你已报名参加此活动"
-        
-        user["registered_activities"].append(activity_id)
-        activity["participants"].append(user_id)
-        self._save_data()
-        return f"成功报名参加活动: {activity['name']}"
+from matcher import VolunteerActivityMatcher
+
+# 初始化应用
+@st.cache_resource
+def get_matcher():
+    """进程内共享的匹配器，只在首次调用时加载数据文件"""
+    # VOLUNTEER_STORAGE 可选 json（默认）、journal（追加日志）或 sqlite
+    # VOLUNTEER_FORMAT 可选 json（默认）、compact、gzip、zstd 或 msgpack
+    # VOLUNTEER_FLUSH_INTERVAL 设置后启用组提交，单位为秒
+    # VOLUNTEER_BACKGROUND_WRITES=1 时由后台线程写盘，界面操作不等待磁盘
+    flush_interval = os.environ.get("VOLUNTEER_FLUSH_INTERVAL")
+    return VolunteerActivityMatcher(
+        backend=os.environ.get("VOLUNTEER_STORAGE", "json"),
+        data_format=os.environ.get("VOLUNTEER_FORMAT", "json"),
+        flush_interval=float(flush_interval) if flush_interval else None,
+        background_writes=os.environ.get("VOLUNTEER_BACKGROUND_WRITES") == "1",
+    )
+
+def register(user_id, activity_id):
+    """报名并等待写入磁盘后再返回结果，超时未写入时不报告成功，写入前被撤销时返回撤销原因"""
+    durable = threading.Event()
+    rejected = []
     
-    def list_activities(self):
-        """列出所有活动"""
-        return self.data["activities"]
+    def reject(reason):
+        rejected.append(reason)
+        durable.set()
     
-    def list_user_activities(self, user_id):
-        """列出用户报名的所有活动"""
-        user = next((u for u in self.data["users"] if u["id"] == user_id), None)
-        if not user:
-            return []
-        
-        return [a for a in self.data["activities"] if a["id"] in user["registered_activities"]]
+    result = matcher.register_for_activity(user_id, activity_id, on_durable=durable.set, on_rejected=reject)
+    if "成功" in result or "候补" in result:
+        if not durable.wait(5):
+            return "报名已提交，但尚未确认写入磁盘，请稍后在“我的活动”中确认报名结果"
+        if rejected:
+            return rejected[0]
+    return result
 
-# 初始化应用
-matcher = VolunteerActivityMatcher()
+matcher = get_matcher()
+# 每次重新运行只比较文件状态，外部修改过数据文件时才重新加载
+matcher.refresh()
+if matcher.load_error:
+    st.error(matcher.load_error)
 
 # 添加示例数据
 if not matcher.data["activities"]:
@@ -223,41 +144,49 @@ elif page == "注册用户":
 elif page == "浏览活动":
     st.header("所有志愿活动")
     
-    activities = matcher.list_activities()
-    if not activities:
+    if not matcher.count_activities():
         st.warning("目前没有可用的活动")
     else:
         # 过滤选项
-        col1, col2 = st.columns(2)
+        col1, col2, col3 = st.columns(3)
         with col1:
-            category_filter = st.selectbox("按类型筛选", ["全部"] + list({a["category"] for a in activities}))
+            category_filter = st.selectbox("按类型筛选", ["全部"] + matcher.activity_categories())
         with col2:
-            location_filter = st.selectbox("按区域筛选", ["全部"] + list({a["location"] for a in activities}))
+            location_filter = st.selectbox("按区域筛选", ["全部"] + matcher.activity_locations())
+        with col3:
+            page_size = st.selectbox("每页显示", [10, 20, 50, 100], index=1)
         
-        # 应用过滤
-        filtered_activities = activities
-        if category_filter != "全部":
-            filtered_activities = [a for a in filtered_activities if a["category"] == category_filter]
-        if location_filter != "全部":
-            filtered_activities = [a for a in filtered_activities if a["location"] == location_filter]
+        # 应用过滤，总数直接从索引得到，只取当前页的活动
+        category = None if category_filter == "全部" else category_filter
+        location = None if location_filter == "全部" else location_filter
+        total = matcher.count_activities(category, location)
+        pages = max(1, -(-total // page_size))
         
-        st.write(f"找到 {len(filtered_activities)} 个活动")
+        st.write(f"找到 {total} 个活动")
+        page_number = st.number_input(f"页码（共 {pages} 页）", min_value=1, max_value=pages, step=1)
         
-        for activity in filtered_activities:
+        # 列表来自活动目录，不含描述；勾选“显示详情”时才读取描述
+        for activity in matcher.page_activities(category, location, (page_number - 1) * page_size, page_size):
             with st.expander(f"{activity['name']} - {activity['location']}"):
                 st.write(f"**类型**: {activity['category']}")
                 st.write(f"**日期**: {activity['date']}")
                 st.write(f"**时间**: {activity['time_range']}")
-                st.write(f"**描述**: {activity['description']}")
-                st.write(f"**参与人数**: {len(activity['participants'])}")
+                st.write(f"**参与人数**: {activity['participant_count']}"
+                         + (f" / {activity['capacity']}" if activity["capacity"] else ""))
+                if st.checkbox("显示详情", key=f"details_{activity['id']}"):
+                    st.write(f"**描述**: {matcher.activity_description(activity['id'])}")
                 
                 # 报名按钮（直接在浏览页面提供报名功能）
                 if st.button(f"报名参加 - {activity['name']}"):
                     user_id = st.number_input("请输入您的用户ID", min_value=1, step=1)
                     if st.button("确认报名"):
-                        result = matcher.register_for_activity(user_id, activity["id"])
+                        result = register(user_id, activity["id"])
                         if "成功" in result:
                             st.success(result)
+                        elif "候补" in result:
+                            st.info(result)
+                        elif "尚未确认" in result:
+                            st.warning(result)
                         else:
                             st.error(result)
 
@@ -265,9 +194,10 @@ elif page == "查找匹配活动":
     st.header("查找匹配的志愿活动")
     
     user_id = st.number_input("请输入您的用户ID", min_value=1, step=1)
+    ranked = st.checkbox("按推荐度排序，只显示最合适的 20 个活动")
     
     if st.button("查找匹配活动"):
-        user = next((u for u in matcher.data["users"] if u["id"] == user_id), None)
+        user = matcher.get_user(user_id)
         if not user:
             st.error("用户不存在，请检查您的用户ID")
         else:
@@ -276,7 +206,10 @@ elif page == "查找匹配活动":
             st.markdown(f"- **偏好类型**: {', '.join(user['preferred_categories'])}")
             st.markdown(f"- **空闲时间**: {', '.join(user['available_days'])}")
             
-            matched = matcher.match_activities(user_id)
+            if ranked:
+                matched = matcher.match_activities(user_id, mode="score", top_k=20)
+            else:
+                matched = matcher.match_activities(user_id)
             
             if not matched:
                 st.warning("没有找到匹配的活动，您可以尝试以下操作：")
@@ -291,12 +224,17 @@ elif page == "查找匹配活动":
                         st.write(f"**日期**: {activity['date']}")
                         st.write(f"**时间**: {activity['time_range']}")
                         st.write(f"**描述**: {activity['description']}")
-                        st.write(f"**参与人数**: {len(activity['participants'])}")
+                        st.write(f"**参与人数**: {len(activity['participants'])}"
+                                 + (f" / {activity['capacity']}" if activity.get("capacity") else ""))
                         
                         if st.button(f"报名参加 - {activity['name']}"):
-                            result = matcher.register_for_activity(user_id, activity["id"])
+                            result = register(user_id, activity["id"])
                             if "成功" in result:
                                 st.success(result)
+                            elif "候补" in result:
+                                st.info(result)
+                            elif "尚未确认" in result:
+                                st.warning(result)
                             else:
                                 st.error(result)
 
@@ -315,10 +253,14 @@ elif page == "报名活动":
         
         if st.button("报名"):
             activity_id = activity_options[selected_activity]
-            result = matcher.register_for_activity(user_id, activity_id)
+            result = register(user_id, activity_id)
             
             if "成功" in result:
                 st.success(result)
+            elif "候补" in result:
+                st.info(result)
+            elif "尚未确认" in result:
+                st.warning(result)
             else:
                 st.error(result)
 
@@ -344,19 +286,11 @@ elif page == "我的活动":
                     st.write(f"**日期**: {activity['date']}")
                     st.write(f"**时间**: {activity['time_range']}")
                     st.write(f"**描述**: {activity['description']}")
-                    st.write(f"**参与人数**: {len(activity['participants'])}")
+                    st.write(f"**参与人数**: {len(activity['participants'])}"
+                             + (f" / {activity['capacity']}" if activity.get("capacity") else ""))
                     
                     # 取消报名功能
                     if st.button(f"取消报名 - {activity['name']}"):
-                        # 从用户已注册活动中移除
-                        user = next(u for u in matcher.data["users"] if u["id"] == user_id)
-                        if activity["id"] in user["registered_activities"]:
-                            user["registered_activities"].remove(activity["id"])
-                        
-                        # 从活动参与者中移除
-                        if user_id in activity["participants"]:
-                            activity["participants"].remove(user_id)
-                        
-                        matcher._save_data()
+                        matcher.cancel_registration(user_id, activity["id"])
                         st.success(f"已成功取消报名: {activity['name']}")
                         st.experimental_rerun()    
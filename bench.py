@@ -0,0 +1,222 @@
+"""性能与并发基准测试
+
+用法:
+    python bench.py contention [--writers 32] [--signups 20] [--backend json] [--flush-interval 0.05] [--background]
+    python bench.py formats [--sizes 10000,100000,1000000]
+    python bench.py capacity [--processes 8] [--threads 32] [--capacity 50] [--cancellations 20] [--backend json]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+from matcher import VolunteerActivityMatcher
+from storage import SNAPSHOT_FORMATS, IdSet, JsonStorage
+
+
+def _contention_worker(data_file, backend, worker, signups, activity_ids, flush_interval, background):
+    matcher = VolunteerActivityMatcher(data_file, backend, flush_interval=flush_interval,
+                                       background_writes=background)
+    user = matcher.register_user(f"writer-{worker}", "东城区", ["环保活动"], ["周一"])
+    for i in range(signups):
+        matcher.register_for_activity(user["id"], activity_ids[i % len(activity_ids)])
+    matcher.close()
+    return user["id"]
+
+
+def bench_contention(args):
+    """多个进程同时注册用户和报名，检查没有丢失的写入和重复的 id"""
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, "volunteer_data.json")
+        matcher = VolunteerActivityMatcher(data_file, args.backend)
+        activity_ids = [
+            # 每周一场，同一个用户报名全部活动也不会时间冲突
+            matcher.add_activity(f"活动{i}", "环保活动", "东城区",
+                                 (date(2026, 1, 5) + timedelta(weeks=i)).isoformat(), "09:00-12:00", "")["id"]
+            for i in range(args.signups)
+        ]
+
+        start = time.perf_counter()
+        with multiprocessing.Pool(args.writers) as pool:
+            user_ids = pool.starmap(
+                _contention_worker,
+                [(data_file, args.backend, w, args.signups, activity_ids, args.flush_interval, args.background)
+                 for w in range(args.writers)],
+            )
+        elapsed = time.perf_counter() - start
+
+        result = VolunteerActivityMatcher(data_file, args.backend)
+        expected = args.writers * args.signups
+        registrations = sum(len(u["registered_activities"]) for u in result.data["users"])
+        participants = sum(len(a["participants"]) for a in result.data["activities"])
+        print(f"backend={args.backend} writers={args.writers} signups/writer={args.signups} "
+              f"flush_interval={args.flush_interval} background={args.background}")
+        print(f"耗时 {elapsed:.2f}s，{expected / elapsed:.0f} 次报名/秒")
+        print(f"用户 {len(result.data['users'])}/{args.writers}，id 唯一: {len(set(user_ids)) == args.writers}")
+        print(f"报名记录 {registrations}/{expected}，活动参与者 {participants}/{expected}")
+        ok = len(set(user_ids)) == args.writers and registrations == participants == expected
+        print("通过" if ok else "失败：存在丢失的写入")
+        return ok
+
+
+def _capacity_worker(data_file, backend, user_ids, activity_id):
+    matcher = VolunteerActivityMatcher(data_file, backend)
+    results = [None] * len(user_ids)
+
+    def signup(i):
+        results[i] = matcher.register_for_activity(user_ids[i], activity_id)
+
+    threads = [threading.Thread(target=signup, args=(i,)) for i in range(len(user_ids))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def bench_capacity(args):
+    """大量进程和线程同时报名同一个限额活动，检查没有超额报名，取消后按顺序从候补名单递补"""
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, "volunteer_data.json")
+        matcher = VolunteerActivityMatcher(data_file, args.backend)
+        activity = matcher.add_activity("热门活动", "环保活动", "东城区", "2026-01-05", "09:00-12:00", "",
+                                        capacity=args.capacity)
+        users, _ = matcher.bulk_register_users([
+            {"name": f"志愿者{i}", "location": "东城区", "preferred_categories": ["环保活动"],
+             "available_days": ["周一"]}
+            for i in range(args.processes * args.threads)
+        ])
+        user_ids = [user["id"] for user in users]
+
+        start = time.perf_counter()
+        with multiprocessing.Pool(args.processes) as pool:
+            results = pool.starmap(_capacity_worker, [
+                (data_file, args.backend, user_ids[p * args.threads:(p + 1) * args.threads], activity["id"])
+                for p in range(args.processes)
+            ])
+        elapsed = time.perf_counter() - start
+
+        results = [r for chunk in results for r in chunk]
+        succeeded = sum("成功" in r for r in results)
+        waiting = sum("候补" in r for r in results)
+        result = VolunteerActivityMatcher(data_file, args.backend)
+        hot = result.get_activity(activity["id"])
+        participants = len(hot["participants"])
+        registered = sum(activity["id"] in u["registered_activities"] for u in result.data["users"])
+        print(f"backend={args.backend} processes={args.processes} threads={args.threads} capacity={args.capacity}")
+        print(f"耗时 {elapsed:.2f}s，{len(results) / elapsed:.0f} 次报名/秒")
+        print(f"成功 {succeeded}，候补 {waiting}，其他 {len(results) - succeeded - waiting}")
+        print(f"活动参与者 {participants}/{args.capacity}，用户报名记录 {registered}，候补名单 {len(hot['waitlist'])}")
+        expected = min(args.capacity, len(results))
+        ok = (succeeded == participants == registered == expected
+              and waiting == len(hot["waitlist"]) == len(results) - expected)
+
+        # 取消一部分报名，候补名单中最早的用户应依次递补
+        cancelled = list(hot["participants"])[:args.cancellations]
+        queued = list(hot["waitlist"])[:len(cancelled)]
+        start = time.perf_counter()
+        for user_id in cancelled:
+            result.cancel_registration(user_id, activity["id"])
+        elapsed = time.perf_counter() - start
+        hot = VolunteerActivityMatcher(data_file, args.backend).get_activity(activity["id"])
+        promoted = [user_id for user_id in queued if user_id in hot["participants"]]
+        print(f"取消 {len(cancelled)} 个报名耗时 {elapsed:.3f}s，递补 {len(promoted)}/{len(queued)}，"
+              f"活动参与者 {len(hot['participants'])}/{args.capacity}")
+        ok = ok and promoted == queued and len(hot["participants"]) == expected
+        print("通过" if ok else "失败：报名人数与名额不一致")
+        return ok
+
+
+def _synthetic_data(records):
+    """生成 records 条记录（其中约 10% 为用户）的随机数据"""
+    rng = random.Random(records)
+    categories = ["环保活动", "教育支持", "关爱老人", "动物保护", "救灾援助"]
+    locations = ["东城区", "西城区", "南城区", "北城区"]
+    days = ["周一", "周二", "周三", "周四", "周五", "周六", "周日"]
+    n_users = max(1, records // 10)
+    n_activities = records - n_users
+    activities = [{
+        "id": i,
+        "name": f"志愿活动 {i}",
+        "category": rng.choice(categories),
+        "location": rng.choice(locations),
+        "date": (date(2026, 1, 1) + timedelta(days=rng.randrange(365))).isoformat(),
+        "time_range": "09:00-12:00",
+        "description": "协助整理社区图书馆书籍，创造良好阅读环境",
+        "participants": IdSet(),
+    } for i in range(1, n_activities + 1)]
+    users = []
+    for i in range(1, n_users + 1):
+        registered = IdSet(rng.randrange(1, n_activities + 1) for _ in range(5))
+        for activity_id in registered:
+            activities[activity_id - 1]["participants"].add(i)
+        users.append({
+            "id": i,
+            "name": f"志愿者 {i}",
+            "location": rng.choice(locations),
+            "preferred_categories": rng.sample(categories, 2),
+            "available_days": rng.sample(days, 3),
+            "registered_activities": registered,
+        })
+    return {"users": users, "activities": activities, "version": 1}
+
+
+def bench_formats(args):
+    """比较各快照格式的保存耗时、加载耗时和文件大小"""
+    formats = [f for f in SNAPSHOT_FORMATS if f in args.formats.split(",")]
+    print(f"{'记录数':>10} {'格式':>8} {'保存(s)':>9} {'加载(s)':>9} {'大小(MB)':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in (int(s) for s in args.sizes.split(",")):
+            data = _synthetic_data(size)
+            for fmt in formats:
+                try:
+                    storage = JsonStorage(os.path.join(tmp, f"data.{fmt}"), backups=0, format=fmt)
+                except ImportError as e:
+                    print(f"{size:>10} {fmt:>8} 跳过: {e}")
+                    continue
+                start = time.perf_counter()
+                storage.save(data)
+                saved = time.perf_counter() - start
+                start = time.perf_counter()
+                storage.load()
+                loaded = time.perf_counter() - start
+                megabytes = os.path.getsize(storage.path) / 1e6
+                print(f"{size:>10} {fmt:>8} {saved:>9.3f} {loaded:>9.3f} {megabytes:>10.2f}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    contention = sub.add_parser("contention", help="并发写入测试")
+    contention.add_argument("--writers", type=int, default=32)
+    contention.add_argument("--signups", type=int, default=20)
+    contention.add_argument("--backend", default="json", choices=["json", "journal", "sqlite"])
+    contention.add_argument("--flush-interval", type=float, help="启用组提交，单位为秒")
+    contention.add_argument("--background", action="store_true", help="启用后台写入线程")
+    contention.set_defaults(func=bench_contention)
+
+    capacity = sub.add_parser("capacity", help="限额活动的并发报名压力测试")
+    capacity.add_argument("--processes", type=int, default=8)
+    capacity.add_argument("--threads", type=int, default=32, help="每个进程的报名线程数")
+    capacity.add_argument("--capacity", type=int, default=50)
+    capacity.add_argument("--cancellations", type=int, default=20, help="测试递补时取消的报名数")
+    capacity.add_argument("--backend", default="json", choices=["json", "journal", "sqlite"])
+    capacity.set_defaults(func=bench_capacity)
+
+    formats = sub.add_parser("formats", help="快照格式对比")
+    formats.add_argument("--sizes", default="10000,100000,1000000", help="逗号分隔的记录数")
+    formats.add_argument("--formats", default=",".join(SNAPSHOT_FORMATS))
+    formats.set_defaults(func=bench_formats)
+
+    args = parser.parse_args()
+    raise SystemExit(0 if args.func(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
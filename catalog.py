@@ -0,0 +1,191 @@
+"""内存映射的列式活动目录
+
+文件由定长的列（id、日期、星期、类型编码、地点编码、名额）和变长的字符串区组成，
+活动描述单独放在最后的描述区，只有调用 description() 时才会读到。
+目录只保存活动发布后不再变化的字段，报名人数等会变化的数据由调用方从内存中补上；
+活动只会新增，文件头记录活动数和 id 之和，调用方据此判断是否需要重新生成。
+文件以只读方式 mmap，多个进程打开同一个目录时共享同一份页缓存。
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from bisect import bisect_left
+from datetime import date, timedelta
+
+MAGIC = b"VCAT"
+FORMAT_VERSION = 3
+
+# 表示日期无效的天数和星期
+NO_DATE = -(2 ** 31)
+NO_WEEKDAY = 7
+
+_EPOCH = date(1970, 1, 1)
+_HEADER = struct.Struct("<4sHHIQ")
+_SECTION = struct.Struct("<QQ")
+
+# (列名, memoryview.cast 使用的类型码)
+_COLUMNS = [
+    ("ids", "I"),
+    ("dates", "i"),
+    ("weekdays", "B"),
+    ("categories", "H"),
+    ("locations", "H"),
+    ("capacities", "I"),
+    ("name_offsets", "Q"),
+    ("time_offsets", "Q"),
+    ("description_offsets", "Q"),
+]
+_BLOBS = ["names", "times", "descriptions", "codes"]
+
+
+def _days(value):
+    try:
+        return (date.fromisoformat(value) - _EPOCH).days
+    except (TypeError, ValueError):
+        return NO_DATE
+
+
+def _pack_strings(values):
+    """把字符串列表编码成 (偏移数组, 拼接后的字节串)，偏移数组比字符串多一项"""
+    offsets = [0]
+    chunks = []
+    for value in values:
+        encoded = (value or "").encode('utf-8')
+        chunks.append(encoded)
+        offsets.append(offsets[-1] + len(encoded))
+    return offsets, b"".join(chunks)
+
+
+def write_catalog(path, activities):
+    """把活动列表写成列式目录文件（按 id 排序），写入临时文件后原子替换"""
+    activities = sorted(activities, key=lambda a: a["id"])
+    category_codes = {}
+    location_codes = {}
+    dates = [_days(a["date"]) for a in activities]
+    name_offsets, names = _pack_strings(a["name"] for a in activities)
+    time_offsets, times = _pack_strings(a.get("time_range", "") for a in activities)
+    description_offsets, descriptions = _pack_strings(a.get("description", "") for a in activities)
+    columns = {
+        "ids": [a["id"] for a in activities],
+        "dates": dates,
+        "weekdays": [NO_WEEKDAY if d == NO_DATE else (d + 3) % 7 for d in dates],
+        "categories": [category_codes.setdefault(a["category"], len(category_codes)) for a in activities],
+        "locations": [location_codes.setdefault(a["location"], len(location_codes)) for a in activities],
+        # 0 表示不限，已有数据中不合法的名额也按不限写入
+        "capacities": [c if isinstance(c, int) and 0 < c < 2 ** 32 else 0
+                       for c in (a.get("capacity") for a in activities)],
+        "name_offsets": name_offsets,
+        "time_offsets": time_offsets,
+        "description_offsets": description_offsets,
+    }
+    codes = json.dumps({"categories": list(category_codes), "locations": list(location_codes)},
+                       ensure_ascii=False).encode('utf-8')
+    payloads = [struct.pack(f"<{len(columns[name])}{code}", *columns[name]) for name, code in _COLUMNS]
+    payloads += [names, times, descriptions, codes]
+
+    flags = 0 if sys.byteorder == "little" else 1
+    offset = _HEADER.size + _SECTION.size * len(payloads)
+    sections = []
+    for payload in payloads:
+        offset += -offset % 8  # 每个区按 8 字节对齐
+        sections.append((offset, len(payload)))
+        offset += len(payload)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, flags, len(activities), sum(columns["ids"])))
+        for section in sections:
+            f.write(_SECTION.pack(*section))
+        for (start, _), payload in zip(sections, payloads):
+            f.write(b"\0" * (start - f.tell()))
+            f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ActivityCatalog:
+    """只读的列式活动目录，按下标或 id 访问活动，不加载描述"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, flags, count, id_sum = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._mmap.close()
+            raise ValueError(f"不是有效的活动目录文件: {path}")
+        if flags != (0 if sys.byteorder == "little" else 1):
+            self._mmap.close()
+            raise ValueError("活动目录文件的字节序与当前平台不一致")
+        self._count = count
+        self.id_sum = id_sum
+        self._view = view = memoryview(self._mmap)
+        sections = [_SECTION.unpack_from(self._mmap, _HEADER.size + i * _SECTION.size)
+                    for i in range(len(_COLUMNS) + len(_BLOBS))]
+        # 定长列直接 cast 成数组视图，不复制数据
+        for (name, code), (start, length) in zip(_COLUMNS, sections):
+            setattr(self, name, view[start:start + length].cast(code))
+        blobs = dict(zip(_BLOBS, sections[len(_COLUMNS):]))
+        self._names = view[blobs["names"][0]:blobs["names"][0] + blobs["names"][1]]
+        self._times = view[blobs["times"][0]:blobs["times"][0] + blobs["times"][1]]
+        self._descriptions = view[blobs["descriptions"][0]:blobs["descriptions"][0] + blobs["descriptions"][1]]
+        start, length = blobs["codes"]
+        codes = json.loads(bytes(view[start:start + length]).decode('utf-8'))
+        self.category_names = codes["categories"]
+        self.location_names = codes["locations"]
+
+    def __len__(self):
+        return self._count
+
+    @staticmethod
+    def _string(blob, offsets, index):
+        return bytes(blob[offsets[index]:offsets[index + 1]]).decode('utf-8')
+
+    def index_of(self, activity_id):
+        """按 id 二分查找活动的下标，不存在时返回 None"""
+        index = bisect_left(self.ids, activity_id)
+        if index < self._count and self.ids[index] == activity_id:
+            return index
+        return None
+
+    def row(self, index):
+        """返回第 index 个活动的列表页字段（不含描述和报名人数）"""
+        days = self.dates[index]
+        return {
+            "id": self.ids[index],
+            "name": self._string(self._names, self.name_offsets, index),
+            "category": self.category_names[self.categories[index]],
+            "location": self.location_names[self.locations[index]],
+            "date": "" if days == NO_DATE else (_EPOCH + timedelta(days=days)).isoformat(),
+            "time_range": self._string(self._times, self.time_offsets, index),
+            "capacity": self.capacities[index] or None,
+        }
+
+    def __getitem__(self, index):
+        if not -self._count <= index < self._count:
+            raise IndexError(index)
+        return self.row(index % self._count)
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self.row(index)
+
+    def description(self, index):
+        """按需读取第 index 个活动的描述"""
+        return self._string(self._descriptions, self.description_offsets, index)
+
+    def close(self):
+        for name, _ in _COLUMNS:
+            getattr(self, name).release()
+        for view in (self._names, self._times, self._descriptions, self._view):
+            view.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
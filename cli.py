@@ -0,0 +1,191 @@
+"""志愿活动数据的命令行工具
+
+用法:
+    python cli.py import activities partner_activities.csv
+    python cli.py import users volunteers.jsonl --batch-size 500 --errors errors.jsonl
+    python cli.py export registrations --format csv --output registrations.csv
+    python cli.py export activities --since-version 1200 > changed_activities.jsonl
+
+增量导出报名关系时，每个变化过的用户先输出一行 activity_id 为空的记录，
+表示用该用户随后的几行替换之前导出的全部报名。
+    python cli.py catalog
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+from itertools import islice
+
+from matcher import VolunteerActivityMatcher
+from storage import SNAPSHOT_FORMATS, IdSet, Waitlist
+
+# CSV 中列表字段的分隔符
+LIST_SEPARATOR = re.compile(r"[,，、;；|]")
+LIST_FIELDS = ("preferred_categories", "available_days")
+
+
+def _detect_format(path, fmt):
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def read_rows(path, fmt=None):
+    """逐行读取 CSV 或 JSONL 文件，产出 (行号, 记录字典或错误信息)"""
+    fmt = _detect_format(path, fmt)
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                for field in LIST_FIELDS:
+                    if isinstance(row.get(field), str):
+                        row[field] = [v.strip() for v in LIST_SEPARATOR.split(row[field]) if v.strip()]
+                yield reader.line_num, row
+        else:
+            for line_num, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield line_num, f"JSON 解析失败: {e}"
+                    continue
+                if not isinstance(row, dict):
+                    yield line_num, "每行应为一个 JSON 对象"
+                    continue
+                yield line_num, row
+
+
+def cmd_import(matcher, args):
+    bulk = matcher.bulk_add_activities if args.kind == "activities" else matcher.bulk_register_users
+    errors_out = open(args.errors, 'w', encoding='utf-8') if args.errors else None
+    added = failed = processed = 0
+
+    def report(line_num, message):
+        if errors_out:
+            errors_out.write(json.dumps({"line": line_num, "error": message}, ensure_ascii=False) + "\n")
+        else:
+            print(f"第 {line_num} 行: {message}", file=sys.stderr)
+
+    try:
+        rows = read_rows(args.file, args.format)
+        while True:
+            batch = list(islice(rows, args.batch_size))
+            if not batch:
+                break
+            valid = []
+            for line_num, row in batch:
+                if isinstance(row, str):
+                    report(line_num, row)
+                    failed += 1
+                else:
+                    valid.append((line_num, row))
+            records, errors = bulk([row for _, row in valid])
+            for index, message in errors:
+                report(valid[index][0], message)
+            added += len(records)
+            failed += len(errors)
+            processed += len(batch)
+            print(f"已处理 {processed} 行，成功 {added}，失败 {failed}", file=sys.stderr)
+    finally:
+        if errors_out:
+            errors_out.close()
+    return 1 if failed else 0
+
+
+USER_FIELDS = ["id", "name", "location", "preferred_categories", "available_days",
+               "registered_activities", "updated_version", "updated_at"]
+ACTIVITY_FIELDS = ["id", "name", "category", "location", "date", "time_range", "description",
+                   "capacity", "participants", "waitlist", "updated_version", "updated_at"]
+
+
+def _csv_value(value):
+    # 候补名单只导出按加入顺序排列的用户 id
+    if isinstance(value, (list, IdSet, Waitlist)):
+        return ",".join(str(v) for v in value)
+    return value
+
+
+def _json_value(value):
+    if isinstance(value, Waitlist):
+        return [[user_id, priority] for user_id, priority in value.items()]
+    return list(value)
+
+
+def cmd_export(matcher, args):
+    since = {"since_version": args.since_version, "since_time": args.since}
+    if args.kind == "registrations":
+        fields = ["user_id", "activity_id"]
+        rows = (dict(zip(fields, pair)) for pair in matcher.iter_registrations(**since))
+    elif args.kind == "users":
+        fields = USER_FIELDS
+        rows = matcher.iter_users(**since)
+    else:
+        fields = ACTIVITY_FIELDS
+        rows = matcher.iter_activities(**since)
+
+    out = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    count = 0
+    try:
+        if args.format == "csv":
+            writer = csv.DictWriter(out, fieldnames=fields, extrasaction='ignore')
+            writer.writeheader()
+            for row in rows:
+                writer.writerow({k: _csv_value(v) for k, v in row.items()})
+                count += 1
+        else:
+            for row in rows:
+                out.write(json.dumps(row, ensure_ascii=False, default=_json_value) + "\n")
+                count += 1
+    finally:
+        if args.output:
+            out.close()
+    # 下次增量导出时以该版本号作为 --since-version
+    print(f"导出 {count} 条记录，当前数据版本 {matcher.version}", file=sys.stderr)
+    return 0
+
+
+def cmd_catalog(matcher, args):
+    path = matcher.build_catalog(args.output)
+    print(f"已写入 {len(matcher.data['activities'])} 个活动到 {path}", file=sys.stderr)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-file", default="volunteer_data.json")
+    parser.add_argument("--backend", default=os.environ.get("VOLUNTEER_STORAGE", "json"),
+                        choices=["json", "journal", "sqlite"])
+    parser.add_argument("--data-format", default=os.environ.get("VOLUNTEER_FORMAT", "json"),
+                        choices=list(SNAPSHOT_FORMATS), help="写快照时使用的格式，读取时自动识别")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    importer = sub.add_parser("import", help="从 CSV/JSONL 文件批量导入活动或用户")
+    importer.add_argument("kind", choices=["activities", "users"])
+    importer.add_argument("file")
+    importer.add_argument("--format", choices=["csv", "jsonl"], help="默认按扩展名判断")
+    importer.add_argument("--batch-size", type=int, default=1000, help="每批在一次写入中持久化的记录数")
+    importer.add_argument("--errors", help="把逐行错误以 JSONL 写入该文件，默认输出到 stderr")
+    importer.set_defaults(func=cmd_import)
+
+    exporter = sub.add_parser("export", help="以 JSONL/CSV 流式导出用户、活动或报名关系")
+    exporter.add_argument("kind", choices=["users", "activities", "registrations"])
+    exporter.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    exporter.add_argument("--output", help="输出文件，默认写到 stdout")
+    exporter.add_argument("--since-version", type=int, help="只导出该版本号之后修改过的记录")
+    exporter.add_argument("--since", help="只导出该时间（ISO 格式，如 2026-10-01T00:00:00）之后修改过的记录")
+    exporter.set_defaults(func=cmd_export)
+
+    catalog = sub.add_parser("catalog", help="生成内存映射的列式活动目录")
+    catalog.add_argument("--output", help="默认为 <数据文件>.catalog")
+    catalog.set_defaults(func=cmd_catalog)
+
+    args = parser.parse_args(argv)
+    matcher = VolunteerActivityMatcher(args.data_file, args.backend, args.data_format)
+    return args.func(matcher, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1079 @@
+import heapq
+import itertools
+import logging
+import re
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+
+from catalog import ActivityCatalog, write_catalog
+from storage import (BackgroundWriterStorage, GroupCommitStorage, IdAllocator, IdSet, Waitlist,
+                     apply_record, open_storage)
+
+try:
+    import numpy as np
+except ImportError:  # 向量化匹配引擎是可选功能
+    np = None
+
+# 星期名称 → weekday() 序号（周一为 0），同时支持中文和英文写法
+WEEKDAY_ORDINALS = {}
+for _ordinal, _names in enumerate([
+    ("周一", "星期一", "monday", "mon"),
+    ("周二", "星期二", "tuesday", "tue"),
+    ("周三", "星期三", "wednesday", "wed"),
+    ("周四", "星期四", "thursday", "thu"),
+    ("周五", "星期五", "friday", "fri"),
+    ("周六", "星期六", "saturday", "sat"),
+    ("周日", "星期日", "sunday", "sun"),
+]):
+    for _name in _names:
+        WEEKDAY_ORDINALS[_name] = _ordinal
+
+
+def weekday_mask(days):
+    """把空闲时间列表转换成星期位掩码，第 i 位对应 weekday() == i"""
+    mask = 0
+    for day in days:
+        ordinal = WEEKDAY_ORDINALS.get(day.strip().lower())
+        if ordinal is not None:
+            mask |= 1 << ordinal
+    return mask
+
+
+def parse_date(value):
+    """解析 YYYY-MM-DD 格式的日期，格式不正确时返回 None"""
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None
+
+
+# 时间段的写法，如 "09:00-12:00"、"9：00 ～ 12：00"、"14:00至16:30"
+TIME_RANGE_PATTERN = re.compile(r"(\d{1,2})[:：](\d{2})\s*(?:-|－|—|~|～|至|到)+\s*(\d{1,2})[:：](\d{2})")
+
+
+def parse_time_range(date_value, time_range):
+    """把日期和时间段解析为 (开始, 结束) 两个 datetime，无法解析时返回 None
+    
+    结束时间不晚于开始时间时视为跨过午夜，结束时间允许写成 24:00。
+    """
+    day = parse_date(date_value)
+    match = TIME_RANGE_PATTERN.search(time_range or "")
+    if day is None or match is None:
+        return None
+    start_hour, start_minute, end_hour, end_minute = map(int, match.groups())
+    if start_hour > 23 or end_hour > 24 or start_minute > 59 or end_minute > 59:
+        return None
+    start = datetime.combine(day, time(start_hour, start_minute))
+    end = datetime.combine(day, time()) + timedelta(hours=end_hour, minutes=end_minute)
+    if end <= start:
+        end += timedelta(days=1)
+    return start, end
+
+
+# 推荐分数中各项的默认权重，可通过 match_activities(weights=...) 覆盖
+SCORE_WEIGHTS = {"category": 3.0, "location": 2.0, "date": 1.0, "capacity": 1.0}
+
+logger = logging.getLogger(__name__)
+
+
+class MatchCache:
+    """匹配结果的 LRU 缓存
+    
+    每个条目保存用户的匹配画像 (星期掩码, 偏好类型, 区域) 和结果中的活动 id，
+    数据变化时按画像判断哪些条目受影响并只删除这些条目。
+    计算结果前记下 generation，期间发生过失效时 put() 会丢弃可能已过期的结果。
+    条目数超过 maxsize 或缓存的 id 总数超过 max_ids 时淘汰最久未使用的条目。
+    """
+    
+    def __init__(self, maxsize=1024, max_ids=100000):
+        self.maxsize = maxsize
+        self.max_ids = max_ids
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def put(self, key, profile, ids, generation):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._pop(key)
+            self._entries[key] = (profile, ids)
+            self._size += len(ids)
+            while self._entries and (len(self._entries) > self.maxsize or self._size > self.max_ids):
+                self._pop(next(iter(self._entries)))
+    
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[1])
+    
+    def discard_where(self, predicate):
+        """删除 predicate(key, profile) 为真的条目"""
+        with self._lock:
+            self.generation += 1
+            for key in [k for k, (profile, _) in self._entries.items() if predicate(k, profile)]:
+                self._pop(key)
+    
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._size = 0
+    
+    def __len__(self):
+        return len(self._entries)
+
+class Schedule:
+    """一个用户已报名活动的时间表：按开始时间排序的 (开始, 结束, 活动 id)，允许时间段互相重叠
+    
+    旧数据中可能有互相重叠的报名，因此不能只比较相邻的几项。max_ends[i] 是前 i + 1 项中最晚的
+    结束时间，查找重叠时从开始时间早于目标结束时间的最后一项往前扫描，前缀中最晚的结束时间
+    不晚于目标开始时间时，更早的项都不可能重叠，可以停止。
+    """
+    
+    __slots__ = ("entries", "max_ends")
+    
+    def __init__(self):
+        self.entries = []
+        self.max_ends = []
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def add(self, start, end, activity_id):
+        entry = (start, end, activity_id)
+        index = bisect_left(self.entries, entry)
+        if index < len(self.entries) and self.entries[index] == entry:
+            return
+        self.entries.insert(index, entry)
+        self.max_ends.insert(index, end)
+        self._update_max_ends(index)
+    
+    def remove(self, start, end, activity_id):
+        entry = (start, end, activity_id)
+        index = bisect_left(self.entries, entry)
+        if index < len(self.entries) and self.entries[index] == entry:
+            del self.entries[index]
+            del self.max_ends[index]
+            self._update_max_ends(index)
+    
+    def _update_max_ends(self, index):
+        latest = self.max_ends[index - 1] if index else None
+        for i in range(index, len(self.entries)):
+            end = self.entries[i][1]
+            if latest is None or end > latest:
+                latest = end
+            self.max_ends[i] = latest
+    
+    def find_overlap(self, start, end, exclude=None):
+        """返回与 [start, end) 重叠的一个活动 id（不包括 exclude），没有时返回 None"""
+        index = bisect_left(self.entries, (end,)) - 1
+        while index >= 0 and self.max_ends[index] > start:
+            _, other_end, other_id = self.entries[index]
+            if other_end > start and other_id != exclude:
+                return other_id
+            index -= 1
+        return None
+
+class VolunteerActivityMatcher:
+    def __init__(self, data_file="volunteer_data.json", backend="json", data_format="json",
+                 flush_interval=None, flush_batch=100, background_writes=False, max_pending=1000):
+        self.data_file = data_file
+        self.storage = open_storage(data_file, backend, data_format)
+        if background_writes:
+            # 后台写入：由专门的线程写盘，积压超过 max_pending 条时写操作等待
+            self.storage = BackgroundWriterStorage(self.storage, max_pending)
+        elif flush_interval:
+            # 组提交：变更攒够一批或每隔 flush_interval 秒才写入一次
+            self.storage = GroupCommitStorage(self.storage, flush_interval, flush_batch)
+        if isinstance(self.storage, GroupCommitStorage):
+            # 落盘前发现其他进程写过文件时，按合并后的数据重新校验尚未落盘的报名
+            self.storage.check = self._recheck_registration
+        self._ids = IdAllocator(data_file + ".seq")
+        # 匹配器在所有会话间共享，写操作需要加锁
+        self._lock = threading.RLock()
+        self._stamp = None
+        # 加载失败时的提示信息，由界面负责展示
+        self.load_error = None
+        # id → 记录 的索引，与 self.data 中的列表共享同一批字典
+        self._users = {}
+        self._activities = {}
+        # 已知的最大 id，作为 id 分配的下限
+        self._max_user_id = 0
+        self._max_activity_id = 0
+        self._activity_id_sum = 0
+        # 活动日期和星期位、用户空闲星期掩码只在加载或新增时计算一次
+        self._activity_dates = {}
+        self._activity_day_bits = {}
+        self._user_day_masks = {}
+        # 倒排索引：类型 / 地点 / 星期 → 活动 id 集合
+        self._by_category = {}
+        self._by_location = {}
+        self._by_weekday = [set() for _ in range(7)]
+        self._vector_engine = None
+        # 浏览页使用的列式活动目录，新增活动后重新生成
+        self._catalog = None
+        self._catalog_lock = threading.Lock()
+        self._match_cache = MatchCache()
+        # 用户侧倒排索引：偏好类型 / 所在区域 / 空闲星期 → 用户 id 集合
+        self._users_by_category = {}
+        self._users_by_location = {}
+        self._users_by_weekday = [set() for _ in range(7)]
+        # 新活动发布时的订阅者，参数为 (活动, 匹配的用户 id 列表)
+        self._subscribers = []
+        # 候补名单：活动 id → 堆 [(-优先级, 序号, 用户 id)]，以及用户当前有效条目的序号，
+        # 离开候补的用户不从堆中删除，弹出时发现序号对不上再丢弃
+        self._waitlists = {}
+        self._wait_seqs = {}
+        self._wait_counter = itertools.count()
+        # 活动 id → (开始, 结束)，以及用户 id → 已报名活动的 Schedule
+        self._activity_spans = {}
+        self._schedules = {}
+        # 活动 id → 锁，同一活动的报名先在这里排队，再进入全局写事务
+        self._activity_locks = {}
+        self.data = self._load_data()
+    
+    def _build_indexes(self, data):
+        """根据加载的数据重建全部索引"""
+        self._users = {u["id"]: u for u in data["users"]}
+        self._activities = {a["id"]: a for a in data["activities"]}
+        self._activity_dates = {}
+        self._activity_day_bits = {}
+        self._user_day_masks = {}
+        self._by_category = {}
+        self._by_location = {}
+        self._by_weekday = [set() for _ in range(7)]
+        self._vector_engine = None
+        self._match_cache.clear()
+        self._users_by_category = {}
+        self._users_by_location = {}
+        self._users_by_weekday = [set() for _ in range(7)]
+        self._waitlists = {}
+        self._wait_seqs = {}
+        self._activity_spans = {}
+        self._schedules = {}
+        self._max_user_id = 0
+        self._max_activity_id = 0
+        self._activity_id_sum = 0
+        for activity in data["activities"]:
+            self._index_activity(activity)
+        for user in data["users"]:
+            self._index_user(user)
+    
+    def _index_activity(self, activity):
+        self._max_activity_id = max(self._max_activity_id, activity["id"])
+        # 活动只会新增，活动数和 id 之和一起用来判断活动目录是否需要重新生成
+        self._activity_id_sum += activity["id"]
+        date = parse_date(activity["date"])
+        self._activity_dates[activity["id"]] = date
+        self._activity_day_bits[activity["id"]] = 1 << date.weekday() if date else 0
+        self._by_category.setdefault(activity["category"], set()).add(activity["id"])
+        self._by_location.setdefault(activity["location"], set()).add(activity["id"])
+        if date:
+            self._by_weekday[date.weekday()].add(activity["id"])
+        span = parse_time_range(activity["date"], activity.get("time_range"))
+        if span:
+            self._activity_spans[activity["id"]] = span
+        for user_id, priority in (activity.get("waitlist") or {}).items():
+            self._push_waiting(activity["id"], user_id, priority)
+    
+    def _push_waiting(self, activity_id, user_id, priority):
+        seq = next(self._wait_counter)
+        self._wait_seqs.setdefault(activity_id, {})[user_id] = seq
+        heapq.heappush(self._waitlists.setdefault(activity_id, []), (-priority, seq, user_id))
+    
+    def _next_waiting(self, activity_id):
+        """返回 (候补名单中下一位可以递补的用户 id, 已不能递补的用户 id 列表)
+        
+        只查看堆顶，失效的条目随查随删，每次均摊 O(log n)。
+        """
+        heap = self._waitlists.get(activity_id, [])
+        seqs = self._wait_seqs.get(activity_id, {})
+        skipped = []
+        while heap:
+            _, seq, user_id = heap[0]
+            if seqs.get(user_id) != seq:
+                heapq.heappop(heap)
+                continue
+            user = self.get_user(user_id)
+            if user is None or activity_id in user["registered_activities"] \
+                    or self._find_conflict(user_id, activity_id) is not None:
+                heapq.heappop(heap)
+                skipped.append(user_id)
+                continue
+            return user_id, skipped
+        return None, skipped
+    
+    def _index_user(self, user):
+        self._max_user_id = max(self._max_user_id, user["id"])
+        day_mask = weekday_mask(user["available_days"])
+        self._user_day_masks[user["id"]] = day_mask
+        for category in set(user["preferred_categories"]):
+            self._users_by_category.setdefault(category, set()).add(user["id"])
+        self._users_by_location.setdefault(user["location"], set()).add(user["id"])
+        for day in range(7):
+            if day_mask >> day & 1:
+                self._users_by_weekday[day].add(user["id"])
+        for activity_id in user["registered_activities"]:
+            self._schedule_add(user["id"], activity_id)
+    
+    def _schedule_add(self, user_id, activity_id):
+        span = self._activity_spans.get(activity_id)
+        if span:
+            self._schedules.setdefault(user_id, Schedule()).add(*span, activity_id)
+    
+    def _schedule_remove(self, user_id, activity_id):
+        span = self._activity_spans.get(activity_id)
+        schedule = self._schedules.get(user_id)
+        if span and schedule:
+            schedule.remove(*span, activity_id)
+    
+    def _find_conflict(self, user_id, activity_id):
+        """返回用户已报名的活动中与该活动时间重叠的一个活动 id，没有冲突或时间未知时返回 None"""
+        span = self._activity_spans.get(activity_id)
+        schedule = self._schedules.get(user_id)
+        if not span or not schedule:
+            return None
+        return schedule.find_overlap(*span, exclude=activity_id)
+    
+    def activity_span(self, activity_id):
+        """返回活动的 (开始, 结束) 时间，时间段无法解析时返回 None"""
+        return self._activity_spans.get(activity_id)
+        
+    def _load_data(self):
+        """加载或初始化数据文件"""
+        with self.storage.locked():
+            # 先记录文件状态再读取，读取期间发生的修改会在下次检查时被发现
+            self._stamp = self.storage.stamp()
+            try:
+                data = self.storage.load()
+                self.load_error = None
+                if self.storage.recovered_from:
+                    logger.warning("数据文件损坏，已从备份恢复: %s", self.storage.recovered_from)
+                    self.load_error = f"数据文件损坏，已从备份 {self.storage.recovered_from} 恢复"
+            except Exception:
+                logger.exception("加载数据文件失败: %s", self.data_file)
+                self.load_error = "数据文件损坏，将创建新文件"
+                data = {"users": [], "activities": []}
+        self._build_indexes(data)
+        return data
+    
+    @property
+    def version(self):
+        """数据版本号，每次写入加一，多个进程之间单调递增"""
+        return self.data.get("version", 0)
+    
+    @contextmanager
+    def _transaction(self):
+        """写事务：持有进程内锁和文件锁，发现磁盘上有更新的数据时先重新加载
+        
+        变更方法在事务内基于最新数据做校验和分配 id，因此并发写入会被合并而不会互相覆盖。
+        """
+        with self._lock, self.storage.locked():
+            if self.storage.stamp() != self._stamp:
+                self.data = self._load_data()
+            yield
+    
+    def _commit(self, record):
+        """应用一条变更并持久化，由存储后端决定写整个文件还是只追加日志
+        
+        必须在 _transaction() 内调用。
+        """
+        self._commit_many([record])
+    
+    def _commit_many(self, records):
+        """应用多条变更并在一次写入中持久化，必须在 _transaction() 内调用"""
+        timestamp = datetime.now().isoformat(timespec="seconds")
+        for record in records:
+            record["version"] = self.version + 1
+            record["timestamp"] = timestamp
+            apply_record(self.data, record, self._users, self._activities)
+            if record["op"] == "add_activity":
+                self._index_activity(record["activity"])
+            elif record["op"] == "register_user":
+                self._index_user(record["user"])
+            elif record["op"] == "waitlist":
+                self._push_waiting(record["activity_id"], record["user_id"], record.get("priority", 0))
+            elif record["op"] in ("register", "promote", "unwaitlist"):
+                self._wait_seqs.get(record["activity_id"], {}).pop(record["user_id"], None)
+            if record["op"] in ("register", "promote"):
+                self._schedule_add(record["user_id"], record["activity_id"])
+            elif record["op"] == "cancel":
+                self._schedule_remove(record["user_id"], record["activity_id"])
+            self._invalidate_matches(record)
+        self.storage.append_many(records, self.data)
+        self._stamp = self.storage.stamp()
+        self.load_error = None
+    
+    def _profile_matches(self, profile, activity_id):
+        day_mask, categories, location = profile
+        activity = self._activities[activity_id]
+        return bool(self._activity_day_bits.get(activity_id, 0) & day_mask) and (
+            activity["category"] in categories or activity["location"] == location
+        )
+    
+    def _invalidate_matches(self, record):
+        """只删除受这条变更影响的缓存结果"""
+        op = record["op"]
+        if op == "add_activity":
+            # 新活动只会出现在画像与它匹配的用户的结果里
+            activity_id = record["activity"]["id"]
+            self._match_cache.discard_where(lambda key, profile: self._profile_matches(profile, activity_id))
+        elif op in ("register", "cancel", "promote") and record["activity_id"] in self._activities:
+            # 报名人数影响推荐分数；该用户的日程变化决定哪些活动因时间冲突被排除
+            activity_id, user_id = record["activity_id"], record["user_id"]
+            self._match_cache.discard_where(
+                lambda key, profile: key[0] == user_id
+                or key[1] == "score" and self._profile_matches(profile, activity_id)
+            )
+    
+    def refresh(self):
+        """数据文件被外部修改时重新加载，返回是否发生了重新加载"""
+        if self.storage.stamp() == self._stamp:
+            return False
+        with self._lock:
+            if self.storage.stamp() == self._stamp:
+                return False
+            self.data = self._load_data()
+        return True
+    
+    def flush(self):
+        """把组提交或后台写入模式下尚未落盘的变更立即写入"""
+        flush = getattr(self.storage, "flush", None)
+        if flush:
+            flush()
+    
+    def close(self):
+        """写入剩余的变更并关闭存储"""
+        close = getattr(self.storage, "close", None)
+        if close:
+            close()
+    
+    def _when_durable(self, callback, record=None, on_rejected=None):
+        when_durable = getattr(self.storage, "when_durable", None)
+        if when_durable:
+            when_durable(callback, record, on_rejected)
+        else:
+            callback()
+    
+    @staticmethod
+    def _recheck_registration(data, record, users, activities):
+        """组提交合并其他进程的写入时，按合并后的数据重新校验报名和递补，返回撤销原因或 None"""
+        if record["op"] not in ("register", "promote"):
+            return None
+        user = users.get(record["user_id"])
+        activity = activities.get(record["activity_id"])
+        if user is None:
+            return "用户不存在"
+        if activity is None:
+            return "活动不存在"
+        if activity["id"] in user["registered_activities"]:
+            return None
+        if activity.get("capacity") and len(activity["participants"]) >= activity["capacity"]:
+            return "活动名额已满"
+        span = parse_time_range(activity["date"], activity.get("time_range"))
+        if span:
+            for other_id in user["registered_activities"]:
+                other = activities.get(other_id)
+                other_span = other and parse_time_range(other["date"], other.get("time_range"))
+                if other_span and other_span[0] < span[1] and span[0] < other_span[1]:
+                    return f"与已报名的活动时间冲突: {other['name']}"
+        return None
+    
+    def invalidate(self):
+        """标记内存数据已过期，下次 refresh() 时强制重新加载"""
+        with self._lock:
+            self._stamp = False
+    
+    def get_user(self, user_id):
+        """按 id 获取用户，不存在时返回 None"""
+        return self._users.get(user_id)
+    
+    def get_activity(self, activity_id):
+        """按 id 获取活动，不存在时返回 None"""
+        return self._activities.get(activity_id)
+    
+    def _new_activity(self, name, category, location, date, time_range, description, capacity=None):
+        return {
+            "id": self._ids.allocate("activities", self._max_activity_id),
+            "name": name,
+            "category": category,
+            "location": location,
+            "date": date,
+            "time_range": time_range,
+            "description": description,
+            "capacity": capacity,
+            "participants": IdSet(),
+            "waitlist": Waitlist()
+        }
+    
+    def _new_user(self, name, location, preferred_categories, available_days):
+        return {
+            "id": self._ids.allocate("users", self._max_user_id),
+            "name": name,
+            "location": location,
+            "preferred_categories": preferred_categories,
+            "available_days": available_days,
+            "registered_activities": IdSet()
+        }
+    
+    @staticmethod
+    def _valid_capacity(capacity):
+        """名额必须是正整数，None 表示不限"""
+        return capacity is None or isinstance(capacity, int) and not isinstance(capacity, bool) and capacity > 0
+    
+    def add_activity(self, name, category, location, date, time_range, description, capacity=None):
+        """添加志愿活动，capacity 为名额上限（正整数），None 表示不限，其他值抛出 ValueError"""
+        if not self._valid_capacity(capacity):
+            raise ValueError(f"名额应为正整数: {capacity!r}")
+        with self._transaction():
+            activity = self._new_activity(name, category, location, date, time_range, description, capacity)
+            self._commit({"op": "add_activity", "activity": activity})
+        self._notify_new_activities([activity])
+        return activity
+    
+    def register_user(self, name, location, preferred_categories, available_days):
+        """注册用户"""
+        with self._transaction():
+            user = self._new_user(name, location, preferred_categories, available_days)
+            self._commit({"op": "register_user", "user": user})
+        return user
+    
+    @staticmethod
+    def _check_fields(row, required):
+        """返回 row 中缺失或为空的必填字段的错误信息，没有问题时返回 None"""
+        missing = [field for field in required if not row.get(field)]
+        if missing:
+            return f"缺少字段: {', '.join(missing)}"
+        return None
+    
+    def bulk_add_activities(self, rows):
+        """批量添加活动，全部有效记录在一次写入中持久化
+        
+        rows 中每一项是包含 add_activity 参数的字典。返回 (新增的活动列表, 错误列表)，
+        错误列表中的每一项为 (在 rows 中的序号, 错误信息)，无效的记录会被跳过。
+        """
+        errors = []
+        with self._transaction():
+            records = []
+            for index, row in enumerate(rows):
+                error = self._check_fields(row, ("name", "category", "location", "date"))
+                if error is None and parse_date(row["date"]) is None:
+                    error = f"日期格式应为 YYYY-MM-DD: {row['date']}"
+                capacity = row.get("capacity")
+                if capacity in (None, ""):
+                    capacity = None
+                elif error is None:
+                    try:
+                        capacity = int(capacity)
+                    except (TypeError, ValueError):
+                        capacity = 0
+                    if not self._valid_capacity(capacity):
+                        error = f"名额应为正整数: {row['capacity']}"
+                if error:
+                    errors.append((index, error))
+                    continue
+                activity = self._new_activity(
+                    row["name"], row["category"], row["location"], row["date"],
+                    row.get("time_range", ""), row.get("description", ""), capacity,
+                )
+                records.append({"op": "add_activity", "activity": activity})
+            if records:
+                self._commit_many(records)
+        activities = [record["activity"] for record in records]
+        self._notify_new_activities(activities)
+        return activities, errors
+    
+    def bulk_register_users(self, rows):
+        """批量注册用户，全部有效记录在一次写入中持久化
+        
+        rows 中每一项是包含 register_user 参数的字典，返回值与 bulk_add_activities 相同。
+        """
+        errors = []
+        with self._transaction():
+            records = []
+            for index, row in enumerate(rows):
+                error = self._check_fields(row, ("name", "location"))
+                for field in ("preferred_categories", "available_days"):
+                    if error is None and not isinstance(row.get(field, []), list):
+                        error = f"{field} 应为列表"
+                days = row.get("available_days", [])
+                if error is None and days and not weekday_mask(days):
+                    error = f"无法识别的空闲时间: {', '.join(days)}"
+                if error:
+                    errors.append((index, error))
+                    continue
+                user = self._new_user(row["name"], row["location"], row.get("preferred_categories", []), days)
+                records.append({"op": "register_user", "user": user})
+            if records:
+                self._commit_many(records)
+        return [record["user"] for record in records], errors
+    
+    def match_activities(self, user_id, mode="filter", top_k=None, weights=None, today=None):
+        """为用户匹配合适的活动
+        
+        mode="filter" 按 id 顺序返回全部满足条件的活动；mode="score" 按推荐分数从高到低
+        返回前 top_k 个（默认全部），分数由类型匹配、地点匹配、日期远近和剩余名额加权得出。
+        与用户已报名活动时间冲突的活动不会出现在结果中。
+        """
+        user = self.get_user(user_id)
+        if not user:
+            return []
+        
+        day_mask = self._user_day_masks.get(user_id, 0)
+        categories = frozenset(user["preferred_categories"])
+        profile = (day_mask, categories, user["location"])
+        if mode == "filter":
+            key = (user_id, mode)
+        elif mode == "score":
+            today = today or datetime.now().date()
+            key = (user_id, mode, top_k, tuple(sorted((weights or {}).items())), today)
+        else:
+            raise ValueError(f"未知的匹配模式: {mode}")
+        
+        ids = self._match_cache.get(key)
+        if ids is None:
+            generation = self._match_cache.generation
+            ids = self._match_ranked_ids(profile, mode, top_k, weights, today, user_id)
+            self._match_cache.put(key, profile, ids, generation)
+        return [self._activities[aid] for aid in ids]
+    
+    def _match_ranked_ids(self, profile, mode, top_k, weights, today, user_id=None):
+        day_mask, categories, location = profile
+        matched_ids = self._match_ids(day_mask, categories, location)
+        if self._schedules.get(user_id):
+            matched_ids = [aid for aid in matched_ids if self._find_conflict(user_id, aid) is None]
+        if mode == "filter":
+            return sorted(matched_ids)
+        
+        score = self._scorer(categories, location, weights, today)
+        # 分数相同时 id 小的排在前面
+        key = lambda aid: (score(aid), -aid)
+        if top_k is None:
+            return sorted(matched_ids, key=key, reverse=True)
+        return heapq.nlargest(top_k, matched_ids, key=key)
+    
+    def _scorer(self, categories, location, weights=None, today=None):
+        """返回计算活动推荐分数的函数"""
+        weights = {**SCORE_WEIGHTS, **(weights or {})}
+        today = today or datetime.now().date()
+        
+        def score(activity_id):
+            activity = self._activities[activity_id]
+            value = 0.0
+            if activity["category"] in categories:
+                value += weights["category"]
+            if activity["location"] == location:
+                value += weights["location"]
+            activity_date = self._activity_dates.get(activity_id)
+            if activity_date is not None and activity_date >= today:
+                # 一周内的活动接近满分，越远分数越低，已经过去的活动不加分
+                value += weights["date"] / (1 + (activity_date - today).days / 7)
+            capacity = activity.get("capacity")
+            if capacity:
+                value += weights["capacity"] * max(capacity - len(activity["participants"]), 0) / capacity
+            else:
+                value += weights["capacity"]
+            return value
+        
+        return score
+    
+    def users_matching_activity(self, activity_id):
+        """反向匹配：返回会匹配到该活动的用户 id（升序）
+        
+        条件与 match_activities 相同：空闲星期包含活动日期，偏好类型或所在区域一致，
+        且与用户已报名的活动时间不冲突。
+        """
+        activity = self.get_activity(activity_id)
+        date = self._activity_dates.get(activity_id)
+        if not activity or date is None:
+            return []
+        day_users = self._users_by_weekday[date.weekday()]
+        category_users = self._users_by_category.get(activity["category"], set())
+        location_users = self._users_by_location.get(activity["location"], set())
+        # 星期 ∩ (类型 ∪ 地点) 用集合运算一次算出，交集会从较小的一侧遍历；
+        # 其他会话可能同时在注册用户，不能在 Python 层逐个遍历这些共享的集合
+        matched = day_users & (category_users | location_users)
+        return sorted(uid for uid in matched if self._find_conflict(uid, activity_id) is None)
+    
+    def subscribe(self, callback):
+        """订阅新活动通知，callback(活动, 匹配的用户 id 列表) 在活动写入成功后调用
+        
+        需要队列时可以传入 queue.put_nowait。返回取消订阅的函数。
+        """
+        self._subscribers.append(callback)
+        return lambda: self._subscribers.remove(callback)
+    
+    def _notify_new_activities(self, activities):
+        if not self._subscribers:
+            return
+        for activity in activities:
+            user_ids = self.users_matching_activity(activity["id"])
+            for callback in list(self._subscribers):
+                try:
+                    callback(activity, user_ids)
+                except Exception:
+                    logger.exception("新活动通知回调失败: %r", callback)
+    
+    def match_users(self, user_ids):
+        """批量匹配，逐个产出 (用户, 匹配的活动列表)
+        
+        空闲星期、偏好类型和所在区域完全相同的用户只计算一次，没有报名日程的用户共享同一个结果列表；
+        产出顺序按分组排列，不保证与 user_ids 的顺序一致，不存在的用户会被跳过。
+        """
+        groups = {}
+        for user_id in user_ids:
+            user = self.get_user(user_id)
+            if not user:
+                continue
+            key = (self._user_day_masks.get(user_id, 0), frozenset(user["preferred_categories"]), user["location"])
+            groups.setdefault(key, []).append(user)
+        
+        for (day_mask, categories, location), users in groups.items():
+            matched = self._match_profile(day_mask, categories, location)
+            for user in users:
+                if self._schedules.get(user["id"]):
+                    # 有报名日程的用户单独排除与日程冲突的活动，不共享分组的结果
+                    yield user, [a for a in matched if self._find_conflict(user["id"], a["id"]) is None]
+                else:
+                    yield user, matched
+    
+    def match_all_users(self):
+        """为所有注册用户批量匹配活动"""
+        return self.match_users(list(self._users))
+    
+    def _match_profile(self, day_mask, categories, location):
+        """按星期掩码、偏好类型集合和区域匹配活动"""
+        return [self._activities[aid] for aid in sorted(self._match_ids(day_mask, categories, location))]
+    
+    def _match_ids(self, day_mask, categories, location):
+        """返回满足匹配条件的活动 id 列表（无序）"""
+        day_sets = [ids for day, ids in enumerate(self._by_weekday) if day_mask >> day & 1]
+        preference_sets = [self._by_category.get(c, ()) for c in categories]
+        preference_sets.append(self._by_location.get(location, ()))
+        
+        # 匹配条件为 星期 ∩ (类型 ∪ 地点)，从较小的一侧出发遍历候选活动
+        if sum(map(len, day_sets)) <= sum(map(len, preference_sets)):
+            candidates = set().union(*day_sets)
+            matched_ids = [
+                aid for aid in candidates
+                if self._activities[aid]["category"] in categories
+                or self._activities[aid]["location"] == location
+            ]
+        else:
+            candidates = set().union(*preference_sets)
+            matched_ids = [aid for aid in candidates if self._activity_day_bits[aid] & day_mask]
+        return matched_ids
+    
+    def register_for_activity(self, user_id, activity_id, on_durable=None, waitlist=True, priority=0,
+                              on_rejected=None):
+        """报名参加活动
+        
+        同一活动的报名先按活动排队，每次只有一个进入全局写事务，热门活动的报名不会占满写锁的
+        等待队列，其他活动的写操作不必排在它们后面。名额在事务内按最新数据检查，不会超额。
+        名额已满时加入候补名单，priority 越大越靠前，相同时按报名先后；
+        waitlist 为 False 时直接拒绝，排到时内存数据是最新的就不必再等待写锁。
+        on_durable 在报名成功并写入磁盘后调用，组提交模式下可能晚于本方法返回。
+        组提交和后台写入模式下，落盘前如果发现其他进程的写入已占满名额或造成时间冲突，
+        这次报名会被撤销，改为调用 on_rejected(原因)，不会调用 on_durable。
+        """
+        if activity_id not in self._activities:
+            # 不为不存在（或其他进程刚添加、尚未加载）的活动创建锁，交给事务重新加载后判断
+            return self._register(user_id, activity_id, on_durable, waitlist, priority, on_rejected)
+        with self._activity_locks.setdefault(activity_id, threading.Lock()):
+            activity = self.get_activity(activity_id)
+            if not waitlist and activity and activity.get("capacity") and self.get_user(user_id) \
+                    and len(activity["participants"]) >= activity["capacity"] \
+                    and user_id not in activity["participants"] and self.storage.stamp() == self._stamp:
+                return "活动名额已满"
+            return self._register(user_id, activity_id, on_durable, waitlist, priority, on_rejected)
+    
+    def _register(self, user_id, activity_id, on_durable, waitlist, priority, on_rejected):
+        with self._transaction():
+            user = self.get_user(user_id)
+            activity = self.get_activity(activity_id)
+            
+            if not user:
+                return "用户不存在"
+            if not activity:
+                return "活动不存在"
+            if activity_id in user["registered_activities"]:
+                return "你已报名参加此活动"
+            clash = self._find_conflict(user_id, activity_id)
+            if clash is not None:
+                return f"与已报名的活动时间冲突: {self._activities[clash]['name']}"
+            if activity.get("capacity") and len(activity["participants"]) >= activity["capacity"]:
+                if not waitlist:
+                    return "活动名额已满"
+                if user_id in activity["waitlist"]:
+                    return "你已在候补名单中"
+                record = {"op": "waitlist", "user_id": user_id, "activity_id": activity_id, "priority": priority}
+                message = "活动名额已满，已加入候补名单"
+            else:
+                record = {"op": "register", "user_id": user_id, "activity_id": activity_id}
+                message = f"成功报名参加活动: {activity['name']}"
+            self._commit(record)
+            if on_durable:
+                # 在同一个事务内登记，后台写入撤销这条报名时才能通知到回调
+                self._when_durable(on_durable, record, on_rejected)
+        return message
+    
+    def cancel_registration(self, user_id, activity_id):
+        """取消报名或退出候补名单，空出名额时由候补名单中的下一位递补"""
+        with self._transaction():
+            user = self.get_user(user_id)
+            activity = self.get_activity(activity_id)
+            if user and activity and user_id in activity["waitlist"]:
+                self._commit({"op": "unwaitlist", "user_id": user_id, "activity_id": activity_id})
+                return True
+            if not user or activity_id not in user["registered_activities"]:
+                return False
+            records = [{"op": "cancel", "user_id": user_id, "activity_id": activity_id}]
+            if activity and activity.get("capacity") and len(activity["participants"]) <= activity["capacity"]:
+                # 只写入取消、递补和清理失效候补这几条变更
+                next_user, skipped = self._next_waiting(activity_id)
+                records += [{"op": "unwaitlist", "user_id": uid, "activity_id": activity_id} for uid in skipped]
+                if next_user is not None:
+                    records.append({"op": "promote", "user_id": next_user, "activity_id": activity_id})
+            self._commit_many(records)
+        return True
+    
+    def list_activities(self):
+        """列出所有活动"""
+        return self.data["activities"]
+    
+    def activity_categories(self):
+        """已有活动的全部类型，直接取自索引"""
+        return sorted(self._by_category)
+    
+    def activity_locations(self):
+        """已有活动的全部区域，直接取自索引"""
+        return sorted(self._by_location)
+    
+    def _filtered_activity_ids(self, category, location):
+        """返回筛选结果的 id 集合，总是一份副本
+        
+        索引集合被所有会话共享，其他会话添加活动时会改变它们；复制和求交集都在 C 中一次完成，
+        之后再遍历副本就不会遇到 "Set changed size during iteration"。
+        """
+        if category is None:
+            return set(self._by_location.get(location, ()))
+        if location is None:
+            return set(self._by_category.get(category, ()))
+        return self._by_category.get(category, set()) & self._by_location.get(location, set())
+    
+    def count_activities(self, category=None, location=None):
+        """按类型、区域筛选后的活动数量，None 表示不限"""
+        if category is None and location is None:
+            return len(self._activities)
+        if location is None:
+            return len(self._by_category.get(category, ()))
+        if category is None:
+            return len(self._by_location.get(location, ()))
+        return len(self._filtered_activity_ids(category, location))
+    
+    def page_activities(self, category=None, location=None, offset=0, limit=20):
+        """按 id 顺序返回筛选后从 offset 开始的 limit 个活动，None 表示不限
+        
+        返回的是活动目录中的行（见 ActivityCatalog.row）加上内存中的报名人数 participant_count，
+        不含描述，描述用 activity_description 按需读取。
+        """
+        catalog = self.catalog()
+        if category is None and location is None:
+            indexes = range(offset, min(offset + limit, len(catalog)))
+        else:
+            ids = self._filtered_activity_ids(category, location)
+            # 只需要前 offset + limit 个 id，不必对整个候选集排序
+            page_ids = heapq.nsmallest(offset + limit, ids)[offset:]
+            # 目录生成之后新增的活动要等下次重新生成才会出现
+            indexes = [i for i in map(catalog.index_of, page_ids) if i is not None]
+        rows = []
+        for index in indexes:
+            row = catalog.row(index)
+            activity = self._activities.get(row["id"])
+            row["participant_count"] = len(activity["participants"]) if activity else 0
+            rows.append(row)
+        return rows
+    
+    def activity_description(self, activity_id):
+        """从活动目录中读取一个活动的描述"""
+        catalog = self.catalog()
+        index = catalog.index_of(activity_id)
+        return "" if index is None else catalog.description(index)
+    
+    def list_user_activities(self, user_id):
+        """列出用户报名的所有活动"""
+        user = self.get_user(user_id)
+        if not user:
+            return []
+        
+        # 先复制一份，其他会话可能正在为同一用户报名或取消
+        return [self._activities[aid] for aid in list(user["registered_activities"]) if aid in self._activities]
+    
+    @staticmethod
+    def _changed_since(item, since_version, since_time):
+        if since_version is not None and item.get("updated_version", 0) <= since_version:
+            return False
+        if since_time is not None and item.get("updated_at", "") < since_time:
+            return False
+        return True
+    
+    def iter_users(self, since_version=None, since_time=None):
+        """逐个产出用户，可只导出某个版本号之后或某个时间（ISO 格式）之后修改过的用户"""
+        for user in self.data["users"]:
+            if self._changed_since(user, since_version, since_time):
+                yield user
+    
+    def iter_activities(self, since_version=None, since_time=None):
+        """逐个产出活动，过滤条件与 iter_users 相同"""
+        for activity in self.data["activities"]:
+            if self._changed_since(activity, since_version, since_time):
+                yield activity
+    
+    def iter_registrations(self, since_version=None, since_time=None):
+        """逐个产出 (user_id, activity_id) 报名关系
+        
+        增量导出时，每个报名关系发生过变化的用户先产出一条 (user_id, None)，表示丢弃该用户
+        之前导出的全部报名，随后产出其当前的全部报名；取消了全部报名的用户只有这一条标记。
+        """
+        incremental = since_version is not None or since_time is not None
+        for user in self.iter_users(since_version, since_time):
+            if incremental:
+                yield user["id"], None
+            for activity_id in user["registered_activities"]:
+                yield user["id"], activity_id
+    
+    def build_catalog(self, path=None):
+        """把当前活动写成内存映射的列式目录文件（见 catalog.py），返回文件路径
+        
+        只在持锁时复制活动列表，写文件不阻塞其他写操作；目录中的字段在活动发布后不再变化。
+        """
+        path = path or self.data_file + ".catalog"
+        with self._lock:
+            activities = list(self.data["activities"])
+        write_catalog(path, activities)
+        return path
+    
+    def _catalog_current(self, catalog):
+        return len(catalog) == len(self._activities) and catalog.id_sum == self._activity_id_sum
+    
+    def catalog(self):
+        """返回包含当前全部活动的活动目录，只在新增活动后重新生成
+        
+        报名、取消等变更不影响目录文件。其他进程已经为同一批活动生成过目录文件时直接打开它。
+        旧的目录对象不主动关闭，其他会话可能还在读，没有引用后随 mmap 一起释放。
+        """
+        catalog = self._catalog
+        if catalog is not None and self._catalog_current(catalog):
+            return catalog
+        with self._catalog_lock:
+            catalog = self._catalog
+            if catalog is not None and self._catalog_current(catalog):
+                return catalog
+            path = self.data_file + ".catalog"
+            try:
+                catalog = ActivityCatalog(path)
+            except (OSError, ValueError):
+                catalog = None
+            if catalog is None or not self._catalog_current(catalog):
+                catalog = ActivityCatalog(self.build_catalog(path))
+            self._catalog = catalog
+        return catalog
+    
+    def vector_engine(self):
+        """返回与当前数据版本对应的向量化匹配引擎，数据变化后自动重建"""
+        with self._lock:
+            engine = self._vector_engine
+            if engine is None or engine.version != self.version:
+                engine = VectorizedMatchEngine(self.data["activities"], self.version, self._find_conflict)
+                self._vector_engine = engine
+        return engine
+
+class VectorizedMatchEngine:
+    """基于 NumPy 的列式匹配引擎，用于大规模活动目录
+    
+    活动按 id 排序后存成列：星期位 (uint8)、类型和地点的整数编码、日期 (datetime64)。
+    传入 find_conflict(用户 id, 活动 id) 时会同样排除与用户日程冲突的活动，
+    此时匹配条件与 match_activities 完全相同，结果顺序也一致。
+    """
+    
+    def __init__(self, activities, version=None, find_conflict=None):
+        if np is None:
+            raise ImportError("向量化匹配需要安装 numpy")
+        self.version = version
+        self.find_conflict = find_conflict
+        self.activities = sorted(activities, key=lambda a: a["id"])
+        self.category_codes = {}
+        self.location_codes = {}
+        self.categories = np.array(
+            [self.category_codes.setdefault(a["category"], len(self.category_codes)) for a in self.activities],
+            dtype=np.int32,
+        )
+        self.locations = np.array(
+            [self.location_codes.setdefault(a["location"], len(self.location_codes)) for a in self.activities],
+            dtype=np.int32,
+        )
+        self.dates = np.array(
+            [a["date"] if parse_date(a["date"]) else "NaT" for a in self.activities],
+            dtype="datetime64[D]",
+        )
+        # 1970-01-01 是周四 (weekday() == 3)
+        valid = ~np.isnat(self.dates)
+        weekdays = (self.dates.astype(np.int64) + 3) % 7
+        self.day_bits = np.where(valid, np.left_shift(1, weekdays), 0).astype(np.uint8)
+    
+    def _category_member(self, categories):
+        member = np.zeros(len(self.category_codes), dtype=bool)
+        for category in categories:
+            code = self.category_codes.get(category)
+            if code is not None:
+                member[code] = True
+        return member
+    
+    def _exclude_conflicts(self, user, activities):
+        if self.find_conflict is None:
+            return activities
+        return [a for a in activities if self.find_conflict(user["id"], a["id"]) is None]
+    
+    def match(self, user):
+        """为单个用户匹配，返回活动列表"""
+        day_mask = weekday_mask(user["available_days"])
+        location = self.location_codes.get(user["location"], -1)
+        hit = (self.day_bits & day_mask) != 0
+        hit &= self._category_member(user["preferred_categories"])[self.categories] | (self.locations == location)
+        return self._exclude_conflicts(user, [self.activities[i] for i in np.flatnonzero(hit)])
+    
+    def match_users(self, users, chunk_size=256):
+        """按用户矩阵批量匹配，逐个产出 (用户, 匹配的活动列表)
+        
+        每批 chunk_size 个用户一起计算 (用户数 × 活动数) 的布尔矩阵，以控制内存占用。
+        """
+        users = list(users)
+        for start in range(0, len(users), chunk_size):
+            chunk = users[start:start + chunk_size]
+            day_masks = np.array([weekday_mask(u["available_days"]) for u in chunk], dtype=np.uint8)
+            locations = np.array([self.location_codes.get(u["location"], -1) for u in chunk], dtype=np.int32)
+            category_member = np.array(
+                [self._category_member(u["preferred_categories"]) for u in chunk], dtype=bool,
+            ).reshape(len(chunk), len(self.category_codes))
+            
+            hits = (self.day_bits[None, :] & day_masks[:, None]) != 0
+            hits &= category_member[:, self.categories] | (self.locations[None, :] == locations[:, None])
+            for user, row in zip(chunk, hits):
+                yield user, self._exclude_conflicts(user, [self.activities[i] for i in np.flatnonzero(row)])
@@ -0,0 +1,1087 @@
+import atexit
+import copy
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+from collections.abc import Mapping, MutableMapping, MutableSet
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 flock，只能保证进程内互斥
+    fcntl = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack 格式是可选的
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # zstd 压缩是可选的
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+
+class IdSet(MutableSet):
+    """保持插入顺序的 id 集合，成员判断和删除都是 O(1)，序列化时仍是 JSON 列表"""
+
+    __slots__ = ("_items",)
+
+    def __init__(self, ids=()):
+        self._items = dict.fromkeys(ids)
+
+    def __contains__(self, item_id):
+        return item_id in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, item_id):
+        self._items[item_id] = None
+
+    def discard(self, item_id):
+        self._items.pop(item_id, None)
+
+    # 兼容原先按列表使用的代码
+    append = add
+
+    def __repr__(self):
+        return f"IdSet({list(self._items)!r})"
+
+
+class Waitlist(MutableMapping):
+    """活动的候补名单：用户 id → 优先级，保持加入顺序，序列化时是 [用户 id, 优先级] 列表
+
+    用列表而不是对象保存，JSON 和 msgpack 中的整数 id 都不会变成字符串键。
+    """
+
+    __slots__ = ("_entries",)
+
+    def __init__(self, entries=()):
+        if isinstance(entries, Mapping):
+            entries = entries.items()
+        self._entries = {user_id: priority for user_id, priority in entries}
+
+    def __getitem__(self, user_id):
+        return self._entries[user_id]
+
+    def __setitem__(self, user_id, priority):
+        self._entries[user_id] = priority
+
+    def __delitem__(self, user_id):
+        del self._entries[user_id]
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"Waitlist({list(self._entries.items())!r})"
+
+
+def _encode(obj):
+    """json.dump 的 default 钩子，把 IdSet 写成列表，Waitlist 写成 [id, 优先级] 列表"""
+    if isinstance(obj, IdSet):
+        return list(obj)
+    if isinstance(obj, Waitlist):
+        return [[user_id, priority] for user_id, priority in obj.items()]
+    raise TypeError(f"无法序列化的类型: {type(obj).__name__}")
+
+
+def hydrate(data):
+    """把从文件读出的报名列表转换成 IdSet，候补名单转换成 Waitlist"""
+    for user in data["users"]:
+        user["registered_activities"] = IdSet(user["registered_activities"])
+    for activity in data["activities"]:
+        activity["participants"] = IdSet(activity["participants"])
+        activity["waitlist"] = Waitlist(activity.get("waitlist", ()))
+    return data
+
+
+# 快照格式：json 为带缩进的可读格式，其余格式都更小、解析更快
+SNAPSHOT_FORMATS = ("json", "compact", "gzip", "zstd", "msgpack")
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def _check_format(fmt):
+    if fmt not in SNAPSHOT_FORMATS:
+        raise ValueError(f"未知的快照格式: {fmt}")
+    if fmt == "zstd" and zstandard is None:
+        raise ImportError("zstd 格式需要安装 zstandard")
+    if fmt == "msgpack" and msgpack is None:
+        raise ImportError("msgpack 格式需要安装 msgpack")
+
+
+def encode_snapshot(data, fmt="json"):
+    """按指定格式把数据编码成字节串"""
+    if fmt == "msgpack":
+        return msgpack.packb(data, default=_encode, use_bin_type=True)
+    if fmt == "json":
+        return json.dumps(data, ensure_ascii=False, indent=2, default=_encode).encode('utf-8')
+    raw = json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=_encode).encode('utf-8')
+    if fmt == "gzip":
+        return gzip.compress(raw, compresslevel=6)
+    if fmt == "zstd":
+        return zstandard.ZstdCompressor().compress(raw)
+    return raw
+
+
+def detect_format(raw):
+    """根据文件头判断快照格式，无法识别时按 JSON 处理"""
+    if raw.startswith(_GZIP_MAGIC):
+        return "gzip"
+    if raw.startswith(_ZSTD_MAGIC):
+        return "zstd"
+    if raw and (0x80 <= raw[0] <= 0x8f or raw[0] in (0xde, 0xdf)):
+        return "msgpack"
+    return "json"
+
+
+def decode_snapshot(raw):
+    """自动识别格式并解码快照，内容无效时抛出 ValueError"""
+    fmt = detect_format(raw)
+    try:
+        if fmt == "msgpack":
+            if msgpack is None:
+                raise ValueError("读取 msgpack 快照需要安装 msgpack")
+            return msgpack.unpackb(raw, raw=False)
+        if fmt == "gzip":
+            raw = gzip.decompress(raw)
+        elif fmt == "zstd":
+            if zstandard is None:
+                raise ValueError("读取 zstd 快照需要安装 zstandard")
+            raw = zstandard.ZstdDecompressor().decompress(raw)
+        return json.loads(raw.decode('utf-8'))
+    except ValueError:
+        raise
+    except Exception as e:
+        # gzip / zstd / msgpack 各自的解码异常统一成 ValueError
+        raise ValueError(f"无法解析 {fmt} 快照: {e}") from e
+
+
+def _find(records, record_id):
+    return next((r for r in records if r["id"] == record_id), None)
+
+
+def _touch(item, record):
+    """在受影响的用户或活动上记录最后修改的版本和时间，供增量导出使用"""
+    if "version" in record:
+        item["updated_version"] = record["version"]
+    if "timestamp" in record:
+        item["updated_at"] = record["timestamp"]
+
+
+def apply_record(data, record, users=None, activities=None):
+    """把一条变更记录应用到内存数据上
+
+    users / activities 为可选的 id→记录 字典，提供时用于查找并同步更新
+    """
+    op = record["op"]
+    if "version" in record:
+        data["version"] = record["version"]
+    if op == "add_activity":
+        activity = record["activity"]
+        activity["participants"] = IdSet(activity["participants"])
+        activity["waitlist"] = Waitlist(activity.get("waitlist", ()))
+        _touch(activity, record)
+        data["activities"].append(activity)
+        if activities is not None:
+            activities[activity["id"]] = activity
+    elif op == "register_user":
+        user = record["user"]
+        user["registered_activities"] = IdSet(user["registered_activities"])
+        _touch(user, record)
+        data["users"].append(user)
+        if users is not None:
+            users[user["id"]] = user
+    elif op in ("register", "cancel", "waitlist", "unwaitlist", "promote"):
+        user_id, activity_id = record["user_id"], record["activity_id"]
+        user = users.get(user_id) if users is not None else _find(data["users"], user_id)
+        activity = activities.get(activity_id) if activities is not None else _find(data["activities"], activity_id)
+        if user is None or activity is None:
+            return
+        _touch(activity, record)
+        waitlist = activity["waitlist"]
+        if op in ("waitlist", "unwaitlist"):
+            # 候补名单只记录在活动上，重新加入时排到最后
+            waitlist.pop(user_id, None)
+            if op == "waitlist":
+                waitlist[user_id] = record.get("priority", 0)
+            return
+        _touch(user, record)
+        if op == "cancel":
+            user["registered_activities"].discard(activity_id)
+            activity["participants"].discard(user_id)
+        else:
+            waitlist.pop(user_id, None)
+            user["registered_activities"].add(activity_id)
+            activity["participants"].add(user_id)
+    else:
+        raise ValueError(f"未知的变更类型: {op}")
+
+
+def replay(data, records):
+    """按顺序重放变更记录，跳过版本号不大于 data["version"] 的记录（快照中已经包含）"""
+    users = {u["id"]: u for u in data["users"]}
+    activities = {a["id"]: a for a in data["activities"]}
+    for record in records:
+        if record.get("version", 0) and record["version"] <= data.get("version", 0):
+            continue
+        apply_record(data, record, users, activities)
+    return data
+
+
+def _file_stamp(path):
+    """返回文件的 (inode, 修改时间, 大小)，文件不存在时返回 None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class FileLock:
+    """跨进程的建议锁（fcntl.flock），同一进程内可重入
+
+    进程内先用 RLock 串行化线程，最外层获取时再对锁文件加 flock；
+    没有 fcntl 的平台上只保留进程内的互斥。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                if self._fd is not None:
+                    os.close(self._fd)
+                    self._fd = None
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+
+
+def _fsync_dir(path):
+    """把目录项的变化（重命名）落盘，不支持的平台上忽略"""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class JsonStorage:
+    """整文件快照存储：每次变更都重写整个 JSON 文件
+
+    快照先写入临时文件并 fsync，再原子地重命名到目标位置，崩溃时不会留下写了一半的文件；
+    同时保留最近 backups 份旧快照 (.bak.1 最新)，主文件损坏时依次回退。
+    """
+
+    recovered_from = None
+    # 每次写入都重写整个快照文件
+    full_rewrite = True
+
+    def __init__(self, path, backups=3, format="json"):
+        _check_format(format)
+        self.path = path
+        self.backups = backups
+        self.format = format
+        self._lock = FileLock(path + ".lock")
+
+    def locked(self):
+        """返回跨进程的写锁，读-校验-写 的整个过程都应在锁内完成"""
+        return self._lock
+
+    def stamp(self):
+        """返回用于判断数据是否被外部修改的文件状态"""
+        return _file_stamp(self.path)
+
+    def backup_paths(self):
+        return [f"{self.path}.bak.{i}" for i in range(1, self.backups + 1)]
+
+    def _read_snapshot(self, path):
+        """读取并解码一份快照，内容无效或结构不对（如 [] 或缺少 users）时抛出 ValueError"""
+        with open(path, 'rb') as f:
+            data = decode_snapshot(f.read())
+        if not isinstance(data, dict) or not isinstance(data.get("users"), list) \
+                or not isinstance(data.get("activities"), list):
+            raise ValueError(f"快照结构不正确: {path}")
+        try:
+            return hydrate(data)
+        except (TypeError, KeyError, AttributeError) as e:
+            raise ValueError(f"快照结构不正确: {path}: {e!r}") from e
+
+    def load(self):
+        """读取数据，文件不存在时返回空数据
+
+        主文件损坏时回退到最新的有效备份并记录在 recovered_from 中，全部无效时抛出原始错误。
+        """
+        self.recovered_from = None
+        candidates = [p for p in self.backup_paths() if os.path.exists(p)]
+        if not os.path.exists(self.path) and not candidates:
+            return {"users": [], "activities": [], "version": 0}
+        try:
+            return self._read_snapshot(self.path)
+        except (OSError, ValueError) as error:
+            for backup in candidates:
+                try:
+                    data = self._read_snapshot(backup)
+                except (OSError, ValueError):
+                    continue
+                self.recovered_from = backup
+                return data
+            raise error
+
+    def _write_temp(self, data):
+        """按配置的格式把快照写入同目录下的临时文件并 fsync，返回临时文件路径"""
+        return self._write_raw(encode_snapshot(data, self.format))
+
+    def _write_raw(self, raw):
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+        return tmp_path
+
+    def _install(self, tmp_path):
+        """轮换旧快照后把临时文件原子地重命名为主文件"""
+        paths = self.backup_paths()
+        if paths and os.path.exists(self.path):
+            for older, newer in zip(reversed(paths[:-1]), reversed(paths[1:])):
+                if os.path.exists(older):
+                    os.replace(older, newer)
+            # 用硬链接保留当前快照，主文件在任何时刻都存在
+            try:
+                os.link(self.path, paths[0])
+            except OSError:
+                shutil.copy2(self.path, paths[0])
+        os.replace(tmp_path, self.path)
+        _fsync_dir(self.path)
+
+    def save(self, data):
+        """写入完整快照"""
+        with self._lock:
+            self._install(self._write_temp(data))
+
+    def append(self, record, data):
+        """持久化一条已应用到 data 上的变更"""
+        self.append_many([record], data)
+
+    def append_many(self, records, data):
+        """在一次写入中持久化多条已应用到 data 上的变更"""
+        self.save(data)
+
+
+class JournalStorage(JsonStorage):
+    """日志存储：每次变更只向日志追加一行，后台定期压缩成快照
+
+    加载时先读快照，再依次重放待压缩的日志 (.log.1) 和当前日志 (.log)。
+    """
+
+    full_rewrite = False
+
+    def __init__(self, path, compact_every=1000, **options):
+        super().__init__(path, **options)
+        self.log_path = path + ".log"
+        self.pending_path = path + ".log.1"
+        self.compact_every = compact_every
+        self._appended = 0
+        self._compactor = None
+
+    def stamp(self):
+        return (super().stamp(), _file_stamp(self.pending_path), _file_stamp(self.log_path))
+
+    def _read_log(self, path):
+        """读取日志记录，忽略崩溃时写了一半的最后一行，无法解析的行记录警告后跳过"""
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            for line_num, line in enumerate(f, 1):
+                if not line.endswith("\n"):
+                    break
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    logger.warning("跳过无法解析的日志行 %s:%d", path, line_num)
+
+    def load(self):
+        with self._lock:
+            data = super().load()
+            replay(data, self._read_log(self.pending_path))
+            # 按磁盘上日志的实际行数计算何时压缩，多个进程或短暂运行的进程的写入都会被计入
+            records = list(self._read_log(self.log_path))
+            replay(data, records)
+            self._appended = len(records)
+            if self._appended >= self.compact_every:
+                self.compact()
+            return data
+
+    def _truncate_torn_tail(self, f):
+        """崩溃可能留下没有换行结尾的半行，截断到最后一个换行符，避免新记录接在半行后面"""
+        end = f.seek(0, os.SEEK_END)
+        if end == 0:
+            return
+        f.seek(end - 1)
+        if f.read(1) == b"\n":
+            return
+        position = end
+        while position > 0:
+            start = max(position - 4096, 0)
+            f.seek(start)
+            index = f.read(position - start).rfind(b"\n")
+            if index >= 0:
+                f.truncate(start + index + 1)
+                return
+            position = start
+        f.truncate(0)
+
+    def append_many(self, records, data):
+        lines = "".join(
+            json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=_encode) + "\n"
+            for record in records
+        ).encode('utf-8')
+        with self._lock:
+            with open(self.log_path, 'ab+') as f:
+                self._truncate_torn_tail(f)
+                f.write(lines)
+            self._appended += len(records)
+            if self._appended >= self.compact_every:
+                self.compact()
+
+    def save(self, data):
+        with self._lock:
+            # 正在进行的压缩会在替换快照前发现文件已变化并放弃结果
+            super().save(data)
+            for path in (self.pending_path, self.log_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._appended = 0
+
+    def compact(self):
+        """把当前日志移到待压缩位置，并在后台线程中合并进快照"""
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            if not os.path.exists(self.pending_path):
+                if not os.path.exists(self.log_path):
+                    return
+                os.replace(self.log_path, self.pending_path)
+            self._appended = 0
+            self._compactor = threading.Thread(target=self._compact_pending, daemon=True)
+            self._compactor.start()
+
+    def _compact_pending(self):
+        # 只依赖磁盘上的快照和待压缩日志，读取和序列化都不需要持锁
+        snapshot_stamp = _file_stamp(self.path)
+        pending_stamp = _file_stamp(self.pending_path)
+        try:
+            data = JsonStorage.load(self)
+            replay(data, self._read_log(self.pending_path))
+        except (OSError, ValueError):
+            return
+        tmp_path = self._write_temp(data)
+        with self._lock:
+            # 期间其他线程或进程已经写过快照或完成了压缩时放弃本次结果
+            if (_file_stamp(self.path) != snapshot_stamp
+                    or pending_stamp is None
+                    or _file_stamp(self.pending_path) != pending_stamp):
+                os.remove(tmp_path)
+                return
+            self._install(tmp_path)
+            os.remove(self.pending_path)
+
+    def wait(self):
+        """等待正在进行的后台压缩完成"""
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+
+class SqliteStorage:
+    """SQLite 存储：用户、活动和报名关系分表保存，每次变更只写受影响的行
+
+    与其他后端一样，匹配器加载时仍会读入全部数据，查询和匹配都走内存中的索引，
+    其他进程写入后也会整体重新加载；这个后端省下的是写入量，而不是内存。
+    因此表上只保留写入时用到的主键和唯一约束，不为查询建索引。
+    """
+
+    recovered_from = None
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            doc TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS activities (
+            id INTEGER PRIMARY KEY,
+            doc TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS registrations (
+            user_id INTEGER NOT NULL,
+            activity_id INTEGER NOT NULL,
+            UNIQUE (user_id, activity_id)
+        );
+        CREATE TABLE IF NOT EXISTS waitlist (
+            activity_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            priority NUMERIC NOT NULL DEFAULT 0,
+            UNIQUE (activity_id, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        -- 旧版本为查询建过的索引没有任何查询使用，只会拖慢写入
+        DROP INDEX IF EXISTS idx_activities_date;
+        DROP INDEX IF EXISTS idx_activities_category;
+        DROP INDEX IF EXISTS idx_activities_location;
+        DROP INDEX IF EXISTS idx_registrations_activity;
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(path + ".lock")
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self._SCHEMA)
+
+    def locked(self):
+        return self._file_lock
+
+    def stamp(self):
+        with self._lock:
+            return self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    @staticmethod
+    def _user_doc(user):
+        return json.dumps({k: v for k, v in user.items() if k != "registered_activities"}, ensure_ascii=False)
+
+    @staticmethod
+    def _activity_doc(activity):
+        return json.dumps({k: v for k, v in activity.items() if k not in ("participants", "waitlist")},
+                          ensure_ascii=False)
+
+    def _insert_user(self, user):
+        self._conn.execute("INSERT OR REPLACE INTO users (id, doc) VALUES (?, ?)",
+                           (user["id"], self._user_doc(user)))
+
+    def _insert_activity(self, activity):
+        self._conn.execute("INSERT OR REPLACE INTO activities (id, doc) VALUES (?, ?)",
+                           (activity["id"], self._activity_doc(activity)))
+
+    def _set_version(self, data):
+        self._conn.execute("UPDATE meta SET value = ? WHERE key = 'version'", (data.get("version", 0),))
+
+    def load(self):
+        with self._lock:
+            users = {}
+            for (doc,) in self._conn.execute("SELECT doc FROM users ORDER BY id"):
+                user = json.loads(doc)
+                user["registered_activities"] = IdSet()
+                users[user["id"]] = user
+            activities = {}
+            for (doc,) in self._conn.execute("SELECT doc FROM activities ORDER BY id"):
+                activity = json.loads(doc)
+                activity["participants"] = IdSet()
+                activity["waitlist"] = Waitlist()
+                activities[activity["id"]] = activity
+            for user_id, activity_id in self._conn.execute(
+                    "SELECT user_id, activity_id FROM registrations ORDER BY rowid"):
+                if user_id in users and activity_id in activities:
+                    users[user_id]["registered_activities"].add(activity_id)
+                    activities[activity_id]["participants"].add(user_id)
+            for activity_id, user_id, priority in self._conn.execute(
+                    "SELECT activity_id, user_id, priority FROM waitlist ORDER BY rowid"):
+                if activity_id in activities:
+                    activities[activity_id]["waitlist"][user_id] = priority
+            return {"users": list(users.values()), "activities": list(activities.values()),
+                    "version": self.stamp()}
+
+    def save(self, data):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for table in ("registrations", "waitlist", "users", "activities"):
+                    self._conn.execute(f"DELETE FROM {table}")
+                for user in data["users"]:
+                    self._insert_user(user)
+                for activity in data["activities"]:
+                    self._insert_activity(activity)
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO registrations (user_id, activity_id) VALUES (?, ?)",
+                    ((user["id"], activity_id) for user in data["users"]
+                     for activity_id in user["registered_activities"]))
+                self._conn.executemany(
+                    "INSERT INTO waitlist (activity_id, user_id, priority) VALUES (?, ?, ?)",
+                    ((activity["id"], user_id, priority) for activity in data["activities"]
+                     for user_id, priority in activity.get("waitlist", {}).items()))
+                self._set_version(data)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _write_record(self, record):
+        op = record["op"]
+        if op == "add_activity":
+            self._insert_activity(record["activity"])
+        elif op == "register_user":
+            self._insert_user(record["user"])
+        elif op in ("register", "cancel", "waitlist", "unwaitlist", "promote"):
+            user_id, activity_id = record["user_id"], record["activity_id"]
+            if op != "cancel":
+                self._conn.execute("DELETE FROM waitlist WHERE activity_id = ? AND user_id = ?",
+                                   (activity_id, user_id))
+            if op == "waitlist":
+                self._conn.execute("INSERT INTO waitlist (activity_id, user_id, priority) VALUES (?, ?, ?)",
+                                   (activity_id, user_id, record.get("priority", 0)))
+            elif op in ("register", "promote"):
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO registrations (user_id, activity_id) VALUES (?, ?)",
+                    (user_id, activity_id))
+            elif op == "cancel":
+                self._conn.execute(
+                    "DELETE FROM registrations WHERE user_id = ? AND activity_id = ?",
+                    (user_id, activity_id))
+            touched = [("activities", activity_id)]
+            if op not in ("waitlist", "unwaitlist"):
+                touched.append(("users", user_id))
+            for table, item_id in touched:
+                self._conn.execute(
+                    f"UPDATE {table} SET doc = json_set(doc, '$.updated_version', ?, '$.updated_at', ?)"
+                    " WHERE id = ?",
+                    (record.get("version"), record.get("timestamp"), item_id))
+        else:
+            raise ValueError(f"未知的变更类型: {op}")
+
+    def append(self, record, data):
+        self.append_many([record], data)
+
+    def append_many(self, records, data):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for record in records:
+                    self._write_record(record)
+                self._set_version(data)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _Acknowledgement:
+    """when_durable() 登记的回调，record 在合并其他进程的写入时被撤销后改为调用 on_rejected(原因)"""
+
+    __slots__ = ("callback", "record", "on_rejected")
+
+    def __init__(self, callback, record=None, on_rejected=None):
+        self.callback = callback
+        self.record = record
+        self.on_rejected = on_rejected
+
+    def __call__(self):
+        error = self.record.get("rejected") if self.record is not None else None
+        if error is None:
+            self.callback()
+        elif self.on_rejected is not None:
+            self.on_rejected(error)
+
+
+class GroupCommitStorage:
+    """组提交包装：变更先记在内存里，每隔 interval 秒或攒够 batch_size 条时一次写入底层存储
+
+    一波报名只触发一次整文件重写。通过 when_durable() 登记的回调在变更真正落盘后才调用；
+    进程退出时会写入剩余的变更，但异常终止时未落盘的变更会丢失。
+    落盘前发现其他进程写过文件时，尚未落盘的变更会合并到最新数据上，并由 check 重新校验。
+    """
+
+    def __init__(self, inner, interval=0.05, batch_size=100):
+        self.inner = inner
+        self.interval = interval
+        self.batch_size = batch_size
+        self._pending = []
+        # 正在由后台线程写入、尚未落盘的变更
+        self._inflight = []
+        self._saves = 0
+        self._callbacks = []
+        self._data = None
+        # 内存数据所基于的底层文件状态，落盘时据此判断是否被其他进程修改过
+        self._base = None
+        # 自己写入后的文件状态和写入前对外报告的状态，自己的写入不应被当作外部修改
+        self._own = None
+        self._alias = None
+        self._closed = threading.Event()
+        self._flusher = None
+        # check(data, record, users, activities) 按合并后的数据重新校验一条变更，
+        # 返回 None 表示仍然有效，否则返回撤销原因；由使用方（匹配器）设置
+        self.check = None
+        # 进程退出时写入剩余的变更，close() 之后解除登记
+        atexit.register(self.close)
+
+    @property
+    def recovered_from(self):
+        return self.inner.recovered_from
+
+    def locked(self):
+        return self.inner.locked()
+
+    def stamp(self):
+        stamp = self.inner.stamp()
+        if self._own is not None and stamp == self._own:
+            return self._alias
+        return stamp
+
+    def _rebase(self, data):
+        """把尚未落盘的变更重新编号后应用到从磁盘读取的数据上
+
+        check 认为已不成立的变更（如名额已被其他进程占满）不再写入，原因记在记录的 "rejected" 上，
+        对应的 when_durable 回调会改为报告失败。
+        """
+        users = {u["id"]: u for u in data["users"]}
+        activities = {a["id"]: a for a in data["activities"]}
+        rejected = False
+        for record in self._inflight + self._pending:
+            error = self.check(data, record, users, activities) if self.check else None
+            if error is not None:
+                logger.warning("合并其他进程的写入后撤销变更 %r: %s", record, error)
+                record["rejected"] = error
+                rejected = True
+                continue
+            record["version"] = data.get("version", 0) + 1
+            apply_record(data, copy.deepcopy(record), users, activities)
+        if rejected:
+            self._inflight = [r for r in self._inflight if "rejected" not in r]
+            self._pending = [r for r in self._pending if "rejected" not in r]
+
+    def load(self):
+        with self.inner.locked():
+            data = self.inner.load()
+            self._base = self.inner.stamp()
+            self._own = None
+            self._rebase(data)
+            self._data = data
+            callbacks = []
+            if not self._pending and not self._inflight:
+                # 待写入的变更全部被撤销时，没有后续写入会触发这些回调
+                callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+        return data
+
+    def save(self, data):
+        with self.inner.locked():
+            self.inner.save(data)
+            self._base = self.inner.stamp()
+            self._own = None
+            self._pending = []
+            self._inflight = []
+            # 完整快照已包含正在后台写入的变更，让那次写入作废
+            self._saves += 1
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def append(self, record, data):
+        self.append_many([record], data)
+
+    def append_many(self, records, data):
+        """只记下变更，由后台线程或攒够一批时统一写入"""
+        with self.inner.locked():
+            self._pending.extend(records)
+            self._data = data
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+            elif self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, daemon=True)
+                self._flusher.start()
+
+    def when_durable(self, callback, record=None, on_rejected=None):
+        """当前所有变更落盘后调用 callback，没有待写入的变更时立即调用
+
+        传入 record 时，这条变更在落盘前被撤销则改为调用 on_rejected(原因)。
+        record 必须在提交它的同一个写事务内登记，否则可能错过撤销。
+        """
+        acknowledgement = _Acknowledgement(callback, record, on_rejected)
+        with self.inner.locked():
+            if self._pending or self._inflight:
+                self._callbacks.append(acknowledgement)
+                return
+        acknowledgement()
+
+    def flush(self):
+        """立即把待写入的变更写入底层存储"""
+        with self.inner.locked():
+            if not self._pending:
+                return
+            reported = self.stamp()
+            data = self._data
+            if self.inner.stamp() != self._base:
+                # 其他进程在此期间写过文件，基于最新数据合并后再写，避免覆盖对方的修改
+                data = self.inner.load()
+                self._rebase(data)
+            self.inner.append_many(self._pending, data)
+            self._base = self._own = self.inner.stamp()
+            self._alias = reported
+            self._pending = []
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def _run(self):
+        while not self._closed.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("组提交写入失败，将在下个周期重试")
+
+    def close(self):
+        """停止后台线程并写入剩余的变更"""
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        # 关闭后不再需要退出时写盘，解除 atexit 对实例的引用，让它可以被回收
+        atexit.unregister(self.close)
+
+
+class _Backpressure:
+    """BackgroundWriterStorage.locked() 返回的锁：最外层获取前先等待积压的变更降到上限以下
+
+    在取得数据锁之前等待，后台线程写入时不会因为请求线程持锁等待而死锁。
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._local = threading.local()
+
+    def __enter__(self):
+        depth = getattr(self._local, "depth", 0)
+        if depth == 0:
+            self.storage._wait_for_room()
+        self.storage.inner.locked().__enter__()
+        self._local.depth = depth + 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._local.depth -= 1
+        self.storage.inner.locked().__exit__(*exc_info)
+
+
+class BackgroundWriterStorage(GroupCommitStorage):
+    """后台写入：请求线程只记下变更，由专门的写线程尽快写入底层存储
+
+    写线程被唤醒时会把这段时间积压的全部变更合并成一次写入。整文件快照只在持锁时序列化，
+    写临时文件和 fsync 在锁外进行，请求线程不会等待磁盘。积压的变更达到 max_pending 条时，
+    新的写事务会在开始前等待（背压）。
+    """
+
+    def __init__(self, inner, max_pending=1000):
+        super().__init__(inner)
+        self.max_pending = max_pending
+        # 唤醒写线程的信号，最多积压一个，多次变更自然合并成一次写入
+        self._wakeups = queue.Queue(maxsize=1)
+        self._room = threading.Condition()
+        self._gate = _Backpressure(self)
+        # 同一时刻只允许一个线程写快照，否则较旧的快照可能覆盖较新的
+        self._flushing = threading.Lock()
+        self._writer = threading.Thread(target=self._run, daemon=True)
+        self._writer.start()
+
+    def locked(self):
+        return self._gate
+
+    def _backlog(self):
+        return len(self._pending) + len(self._inflight)
+
+    def _wait_for_room(self):
+        with self._room:
+            while self._backlog() >= self.max_pending and self._writer.is_alive():
+                self._room.wait(0.1)
+
+    def append_many(self, records, data):
+        with self.inner.locked():
+            self._pending.extend(records)
+            self._data = data
+        try:
+            self._wakeups.put_nowait(True)
+        except queue.Full:
+            pass
+
+    def flush(self):
+        """把积压的变更写入底层存储，返回前全部落盘"""
+        with self._flushing:
+            if not getattr(self.inner, "full_rewrite", False):
+                super().flush()
+            else:
+                while self._flush_snapshot():
+                    pass
+        with self._room:
+            self._room.notify_all()
+
+    def _flush_snapshot(self):
+        """写入一次整文件快照，写入期间文件被其他进程修改时返回 True 表示需要重试"""
+        inner = self.inner
+        with inner.locked():
+            if not self._pending:
+                return False
+            saves = self._saves
+            data = self._data
+            if inner.stamp() != self._base:
+                data = inner.load()
+                self._rebase(data)
+                self._base = inner.stamp()
+            base = self._base
+            reported = self.stamp()
+            self._inflight, self._pending = self._pending, []
+            callbacks, self._callbacks = self._callbacks, []
+            raw = encode_snapshot(data, inner.format)
+        try:
+            tmp_path = inner._write_raw(raw)
+        except BaseException:
+            with inner.locked():
+                self._pending[:0] = self._inflight
+                self._inflight = []
+                self._callbacks[:0] = callbacks
+            raise
+        with inner.locked():
+            if self._saves != saves:
+                # 期间已经保存过完整快照
+                os.remove(tmp_path)
+                return False
+            if inner.stamp() != base:
+                # 写临时文件期间其他进程写过文件，放弃这份快照，合并后重写
+                os.remove(tmp_path)
+                self._pending[:0] = self._inflight
+                self._inflight = []
+                self._callbacks[:0] = callbacks
+                return True
+            inner._install(tmp_path)
+            self._base = self._own = inner.stamp()
+            self._alias = reported
+            self._inflight = []
+            if not self._pending:
+                # 写入期间登记的回调没有新的变更要等
+                callbacks += self._callbacks
+                self._callbacks = []
+        for callback in callbacks:
+            callback()
+        return False
+
+    def _run(self):
+        while True:
+            if self._wakeups.get() is None:
+                return
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("后台写入失败，将在下次变更时重试")
+
+    def close(self):
+        """等待写线程写完积压的变更后停止"""
+        if self._writer.is_alive():
+            self._wakeups.put(None)
+            self._writer.join()
+        GroupCommitStorage.flush(self)
+        atexit.unregister(self.close)
+
+
+class IdAllocator:
+    """持久化的单调 id 分配器，与数据列表的长度无关
+
+    高水位保存在独立的序列文件中。每个进程一次预留 block_size 个 id，
+    只有用完一块时才需要对序列文件加锁，块内的 id 在进程内直接发放。
+    """
+
+    def __init__(self, path, block_size=32):
+        self.path = path
+        self.block_size = block_size
+        self._file_lock = FileLock(path + ".lock")
+        self._lock = threading.Lock()
+        self._blocks = {}
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _reserve(self, kind, floor):
+        with self._file_lock:
+            marks = self._read()
+            start = max(marks.get(kind, 0), floor) + 1
+            marks[kind] = start + self.block_size - 1
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(marks, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        return [start, start + self.block_size]
+
+    def allocate(self, kind, floor=0):
+        """分配一个 kind 类型的新 id，保证大于 floor（已知的最大 id）"""
+        with self._lock:
+            block = self._blocks.get(kind)
+            if block is None or block[0] >= block[1] or block[1] - 1 <= floor:
+                block = self._blocks[kind] = self._reserve(kind, floor)
+            block[0] = max(block[0], floor + 1)
+            next_id = block[0]
+            block[0] += 1
+            return next_id
+
+
+def open_storage(path, backend="json", format="json"):
+    """按名称创建存储后端，sqlite 后端使用同名的 .db 文件
+
+    format 指定 json / journal 后端写快照时使用的格式，读取时总是自动识别。
+    """
+    if backend == "json":
+        return JsonStorage(path, format=format)
+    if backend == "journal":
+        return JournalStorage(path, format=format)
+    if backend == "sqlite":
+        return SqliteStorage(os.path.splitext(path)[0] + ".db")
+    raise ValueError(f"未知的存储后端: {backend}")
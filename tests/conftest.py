@@ -0,0 +1,37 @@
+import os
+import sys
+import weakref
+
+import pytest
+
+# 模块都在仓库根目录下，测试时把根目录加入导入路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matcher import VolunteerActivityMatcher  # noqa: E402
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    """测试用的数据文件路径，同一个测试中的匹配器都打开这个文件"""
+    return str(tmp_path / "volunteer_data.json")
+
+
+@pytest.fixture
+def open_matcher(data_file):
+    """返回创建匹配器的函数，默认使用日志后端（构造数据快），测试结束时关闭仍存活的匹配器
+
+    同一个测试中多次调用得到的匹配器共用一个数据文件，相当于多个进程。
+    只保留弱引用，不妨碍测试检查匹配器能否被回收。
+    """
+    opened = []
+
+    def open_matcher(backend="journal", **options):
+        matcher = VolunteerActivityMatcher(data_file, backend=backend, **options)
+        opened.append(weakref.ref(matcher))
+        return matcher
+
+    yield open_matcher
+    for ref in opened:
+        matcher = ref()
+        if matcher is not None:
+            matcher.close()
@@ -0,0 +1,56 @@
+"""快照损坏时回退到备份的测试"""
+import pytest
+
+from matcher import VolunteerActivityMatcher
+from storage import JsonStorage
+
+
+def _write_versions(path):
+    matcher = VolunteerActivityMatcher(str(path))
+    for i in range(3):
+        matcher.add_activity(f"活动{i}", "环保活动", "东城区", "2026-05-04", "", "")
+    return matcher
+
+
+@pytest.mark.parametrize("content", [
+    b"[]",
+    b"{}",
+    b'{"users": [], "activities": {}}',
+    b'{"users": [{"id": 1}], "activities": []}',
+    b'{"users": [], "activities": [1]}',
+    b'{"users": [], "act',
+    b"",
+])
+def test_falls_back_to_latest_valid_backup(tmp_path, content):
+    path = tmp_path / "volunteer_data.json"
+    _write_versions(path)
+    path.write_bytes(content)
+
+    storage = JsonStorage(str(path))
+    data = storage.load()
+    # .bak.1 是写入第 3 个活动之前的快照
+    assert storage.recovered_from == f"{path}.bak.1"
+    assert [a["name"] for a in data["activities"]] == ["活动0", "活动1"]
+
+    matcher = VolunteerActivityMatcher(str(path))
+    assert "备份" in matcher.load_error
+    assert matcher.count_activities() == 2
+
+
+def test_skips_invalid_backups(tmp_path):
+    path = tmp_path / "volunteer_data.json"
+    _write_versions(path)
+    path.write_bytes(b"[]")
+    (tmp_path / "volunteer_data.json.bak.1").write_bytes(b'{"users": null}')
+
+    storage = JsonStorage(str(path))
+    data = storage.load()
+    assert storage.recovered_from == f"{path}.bak.2"
+    assert [a["name"] for a in data["activities"]] == ["活动0"]
+
+
+def test_raises_when_nothing_is_valid(tmp_path):
+    path = tmp_path / "volunteer_data.json"
+    path.write_bytes(b"[]")
+    with pytest.raises(ValueError):
+        JsonStorage(str(path)).load()
@@ -0,0 +1,50 @@
+"""活动名额测试"""
+import threading
+
+import pytest
+
+
+def _users(matcher, count):
+    return [matcher.register_user(f"志愿者{i}", "东城区", ["环保活动"], ["周一"])["id"] for i in range(count)]
+
+
+def test_full_activity_rejects_without_waitlist(open_matcher):
+    matcher = open_matcher()
+    matcher.add_activity("清理河道", "环保活动", "东城区", "2026-05-04", "09:00-12:00", "", capacity=1)
+    first, second = _users(matcher, 2)
+    assert matcher.register_for_activity(first, 1, waitlist=False).startswith("成功")
+    assert matcher.register_for_activity(second, 1, waitlist=False) == "活动名额已满"
+    assert matcher.register_for_activity(first, 1, waitlist=False) == "你已报名参加此活动"
+    assert list(matcher.get_activity(1)["participants"]) == [first]
+    assert matcher.register_for_activity(9999, 1, waitlist=False) == "用户不存在"
+
+
+@pytest.mark.parametrize("capacity", [0, -1, 2.5, "3", True])
+def test_add_activity_rejects_invalid_capacity(open_matcher, capacity):
+    matcher = open_matcher()
+    with pytest.raises(ValueError):
+        matcher.add_activity("清理河道", "环保活动", "东城区", "2026-05-04", "09:00-12:00", "", capacity=capacity)
+    assert matcher.count_activities() == 0
+    assert matcher.page_activities() == []
+
+
+def test_concurrent_signups_never_exceed_capacity(open_matcher):
+    # 两个匹配器实例共用一个数据文件，相当于两个进程
+    matchers = [open_matcher(), open_matcher()]
+    matchers[0].add_activity("清理河道", "环保活动", "东城区", "2026-05-04", "09:00-12:00", "", capacity=5)
+    user_ids = _users(matchers[0], 40)
+    results = []
+
+    def sign_up(matcher, ids):
+        for user_id in ids:
+            results.append(matcher.register_for_activity(user_id, 1, waitlist=False))
+
+    threads = [threading.Thread(target=sign_up, args=(matchers[i % 2], user_ids[i::4])) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(r.startswith("成功") for r in results) == 5
+    assert results.count("活动名额已满") == 35
+    assert len(open_matcher().get_activity(1)["participants"]) == 5
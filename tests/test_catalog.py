@@ -0,0 +1,61 @@
+"""浏览页使用的列式活动目录测试"""
+import os
+
+from catalog import ActivityCatalog
+
+
+def _setup(open_matcher):
+    matcher = open_matcher()
+    matcher.add_activity("清理河道", "环保活动", "东城区", "2026-05-04", "09:00-12:00", "带好手套", capacity=2)
+    matcher.add_activity("陪伴老人", "关爱老人", "西城区", "无效日期", "", "")
+    matcher.add_activity("课后辅导", "教育支持", "东城区", "2026-05-06", "14:00-16:00", "小学数学")
+    return matcher
+
+
+def test_rows_match_activities(open_matcher):
+    matcher = _setup(open_matcher)
+    with ActivityCatalog(matcher.build_catalog()) as catalog:
+        assert catalog.id_sum == sum(a["id"] for a in matcher.data["activities"])
+        assert len(catalog) == len(matcher.data["activities"])
+        for index, activity in enumerate(matcher.data["activities"]):
+            row = catalog.row(index)
+            assert catalog.index_of(activity["id"]) == index
+            assert row["name"] == activity["name"]
+            assert row["category"] == activity["category"]
+            assert row["location"] == activity["location"]
+            assert row["date"] == ("" if activity["date"] == "无效日期" else activity["date"])
+            assert row["time_range"] == activity["time_range"]
+            assert row["capacity"] == activity["capacity"]
+            assert "description" not in row
+            assert catalog.description(index) == activity["description"]
+        assert catalog.index_of(999) is None
+
+
+def test_catalog_is_rebuilt_only_when_activities_are_added(open_matcher):
+    matcher = _setup(open_matcher)
+    user = matcher.register_user("张三", "东城区", ["环保活动"], ["周一"])
+    first = matcher.catalog()
+    assert [row["id"] for row in matcher.page_activities(location="东城区")] == [1, 3]
+    assert matcher.page_activities(offset=1, limit=1)[0]["name"] == "陪伴老人"
+
+    # 报名人数来自内存，报名不会重新生成目录文件
+    mtime = os.stat(first.path).st_mtime_ns
+    matcher.register_for_activity(user["id"], 1)
+    assert matcher.catalog() is first
+    assert os.stat(first.path).st_mtime_ns == mtime
+    assert matcher.page_activities(category="环保活动")[0]["participant_count"] == 1
+    assert matcher.activity_description(3) == "小学数学"
+    assert matcher.activity_description(999) == ""
+
+    matcher.add_activity("看望孤寡老人", "关爱老人", "南城区", "2026-05-07", "", "")
+    assert matcher.catalog() is not first
+    assert [row["id"] for row in matcher.page_activities(category="关爱老人")] == [2, 4]
+
+
+def test_reuses_catalog_built_by_another_process(open_matcher):
+    matcher = _setup(open_matcher)
+    path = matcher.build_catalog()
+    other = open_matcher()
+    mtime = os.stat(path).st_mtime_ns
+    assert len(other.catalog()) == 3
+    assert os.stat(path).st_mtime_ns == mtime
@@ -0,0 +1,53 @@
+"""报名关系增量导出测试"""
+import json
+
+import cli
+
+
+def _setup(open_matcher):
+    matcher = open_matcher()
+    matcher.add_activity("清理河道", "环保活动", "东城区", "2026-05-04", "09:00-12:00", "")
+    matcher.add_activity("课后辅导", "教育支持", "东城区", "2026-05-05", "14:00-16:00", "")
+    first = matcher.register_user("张三", "东城区", ["环保活动"], ["周一"])["id"]
+    second = matcher.register_user("李四", "东城区", ["环保活动"], ["周一"])["id"]
+    matcher.register_for_activity(first, 1)
+    matcher.register_for_activity(first, 2)
+    matcher.register_for_activity(second, 1)
+    return matcher, first, second
+
+
+def _apply(exported, rows):
+    """按文档约定把增量导出合并进之前导出的报名关系"""
+    for user_id, activity_id in rows:
+        if activity_id is None:
+            exported = {pair for pair in exported if pair[0] != user_id}
+        else:
+            exported.add((user_id, activity_id))
+    return exported
+
+
+def test_full_export_has_no_markers(open_matcher):
+    matcher, first, second = _setup(open_matcher)
+    assert sorted(matcher.iter_registrations()) == [(first, 1), (first, 2), (second, 1)]
+
+
+def test_incremental_export_shows_cancellations(open_matcher):
+    matcher, first, second = _setup(open_matcher)
+    exported = set(matcher.iter_registrations())
+    version = matcher.version
+
+    matcher.cancel_registration(second, 1)
+    matcher.cancel_registration(first, 2)
+    rows = list(matcher.iter_registrations(since_version=version))
+    assert sorted(rows, key=repr) == sorted([(first, None), (first, 1), (second, None)], key=repr)
+    assert _apply(exported, rows) == set(matcher.iter_registrations()) == {(first, 1)}
+
+
+def test_cli_writes_marker_rows(open_matcher, capsys):
+    matcher, first, second = _setup(open_matcher)
+    version = matcher.version
+    matcher.cancel_registration(second, 1)
+    cli.main(["--data-file", matcher.data_file, "--backend", "journal",
+              "export", "registrations", "--since-version", str(version)])
+    rows = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert rows == [{"user_id": second, "activity_id": None}]
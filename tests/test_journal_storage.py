@@ -0,0 +1,61 @@
+"""日志存储的崩溃恢复与压缩测试"""
+from storage import JournalStorage, replay
+
+
+def test_writes_survive_reload(open_matcher):
+    matcher = open_matcher()
+    matcher.add_activity("清理河道", "环保活动", "东城区", "2026-05-04", "09:00-12:00", "")
+    user = matcher.register_user("张三", "东城区", ["环保活动"], ["周一"])
+    matcher.register_for_activity(user["id"], 1)
+
+    reloaded = open_matcher()
+    assert reloaded.version == matcher.version
+    assert list(reloaded.get_user(user["id"])["registered_activities"]) == [1]
+    assert list(reloaded.get_activity(1)["participants"]) == [user["id"]]
+
+
+def test_torn_tail_is_dropped_and_not_glued_to_next_record(open_matcher):
+    matcher = open_matcher()
+    matcher.add_activity("清理河道", "环保活动", "东城区", "2026-05-04", "09:00-12:00", "")
+    log_path = matcher.storage.log_path
+    # 模拟崩溃时只写了一半的记录
+    with open(log_path, 'ab') as f:
+        f.write('{"op":"add_activity","activity":{"id":99,"na'.encode('utf-8'))
+
+    reloaded = open_matcher()
+    assert [a["id"] for a in reloaded.data["activities"]] == [1]
+    reloaded.add_activity("陪伴老人", "关爱老人", "西城区", "2026-05-05", "", "")
+    with open(log_path, 'rb') as f:
+        assert b'"id":99' not in f.read()
+    assert [a["name"] for a in open_matcher().data["activities"]] == ["清理河道", "陪伴老人"]
+
+
+def test_replay_skips_records_already_in_snapshot(open_matcher):
+    matcher = open_matcher()
+    matcher.add_activity("清理河道", "环保活动", "东城区", "2026-05-04", "09:00-12:00", "", capacity=1)
+    first = matcher.register_user("张三", "东城区", ["环保活动"], ["周一"])
+    second = matcher.register_user("李四", "东城区", ["环保活动"], ["周一"])
+    matcher.register_for_activity(first["id"], 1)
+    matcher.register_for_activity(second["id"], 1)
+    records = list(matcher.storage._read_log(matcher.storage.log_path))
+    snapshot = matcher.data
+
+    # 快照已经包含这些记录，压缩后崩溃留下的日志不能再被重放一遍
+    replayed = replay(snapshot, records)
+    assert len(replayed["activities"]) == 1
+    assert len(replayed["users"]) == 2
+    assert list(replayed["activities"][0]["participants"]) == [first["id"]]
+    assert list(replayed["activities"][0]["waitlist"]) == [second["id"]]
+
+
+def test_load_compacts_long_log(open_matcher, data_file):
+    matcher = open_matcher()
+    for i in range(5):
+        matcher.add_activity(f"活动{i}", "环保活动", "东城区", "2026-05-04", "", "")
+
+    storage = JournalStorage(data_file, compact_every=5)
+    data = storage.load()
+    storage.wait()
+    assert len(data["activities"]) == 5
+    assert len(list(storage._read_log(storage.log_path))) == 0
+    assert len(JournalStorage(data_file).load()["activities"]) == 5
@@ -0,0 +1,118 @@
+"""向量化匹配引擎、批量匹配与 match_activities 的一致性测试"""
+import random
+from datetime import datetime
+
+import pytest
+
+from matcher import parse_time_range
+
+np = pytest.importorskip("numpy")
+
+CATEGORIES = ["环保活动", "教育支持", "关爱老人", "动物保护", "救灾援助"]
+LOCATIONS = ["东城区", "西城区", "南城区", "北城区"]
+DAYS = ["周一", "周二", "周三", "周四", "周五", "周六", "周日", "星期三", "Monday", "fri", "sun"]
+INVALID_DATES = ["", "2026-13-01", "2026/01/05", "明天"]
+TIME_RANGES = ["09:00-12:00", "10:00-11:00", "11:30-13:00", "14:00-16:30", "22:00-02:00", "", "全天"]
+ENGLISH_DAYS = {"周一": "monday", "周二": "tuesday", "周三": "wednesday", "周四": "thursday",
+                "周五": "friday", "周六": "saturday", "周日": "sunday", "星期三": "wednesday"}
+
+
+def _random_date(rng):
+    if rng.random() < 0.1:
+        return rng.choice(INVALID_DATES)
+    return f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+
+
+def _build(open_matcher, seed):
+    rng = random.Random(seed)
+    # 日志后端每次写入只追加一行，构造数据比整文件重写快得多
+    matcher = open_matcher()
+    for i in range(200):
+        matcher.add_activity(
+            f"活动{i}", rng.choice(CATEGORIES + ["未知类型"]), rng.choice(LOCATIONS + ["外地"]),
+            _random_date(rng), rng.choice(TIME_RANGES), "",
+        )
+    for i in range(60):
+        matcher.register_user(
+            f"志愿者{i}", rng.choice(LOCATIONS + ["未知区域"]),
+            rng.sample(CATEGORIES, rng.randint(0, 3)), rng.sample(DAYS, rng.randint(0, 5)),
+        )
+    activity_ids = [a["id"] for a in matcher.data["activities"]]
+    for user in matcher.data["users"]:
+        for activity_id in rng.sample(activity_ids, rng.randint(0, 4)):
+            matcher.register_for_activity(user["id"], activity_id)
+    return matcher
+
+
+def _reference(matcher, user):
+    """不使用任何索引的逐个比较，作为标准答案"""
+    days = {ENGLISH_DAYS.get(d, d.lower()) for d in user["available_days"]}
+    registered = [matcher.get_activity(aid) for aid in user["registered_activities"]]
+    result = []
+    for activity in matcher.data["activities"]:
+        try:
+            weekday = datetime.strptime(activity["date"], "%Y-%m-%d").strftime("%A").lower()
+        except ValueError:
+            continue
+        if not any(weekday.startswith(d) for d in days):
+            continue
+        if activity["category"] not in user["preferred_categories"] and activity["location"] != user["location"]:
+            continue
+        span = parse_time_range(activity["date"], activity["time_range"])
+        clashes = False
+        for other in registered:
+            other_span = parse_time_range(other["date"], other["time_range"])
+            if other["id"] != activity["id"] and span and other_span \
+                    and span[0] < other_span[1] and other_span[0] < span[1]:
+                clashes = True
+        if not clashes:
+            result.append(activity["id"])
+    return result
+
+
+def _ids(activities):
+    return [a["id"] for a in activities]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_match_activities_matches_reference(open_matcher, seed):
+    matcher = _build(open_matcher, seed)
+    for user in matcher.data["users"]:
+        assert _ids(matcher.match_activities(user["id"])) == _reference(matcher, user)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_vector_engine_matches_match_activities(open_matcher, seed):
+    matcher = _build(open_matcher, seed)
+    engine = matcher.vector_engine()
+    expected = {u["id"]: _ids(matcher.match_activities(u["id"])) for u in matcher.data["users"]}
+    for user in matcher.data["users"]:
+        assert _ids(engine.match(user)) == expected[user["id"]]
+    batched = {user["id"]: _ids(matched) for user, matched in engine.match_users(matcher.data["users"], chunk_size=7)}
+    assert batched == expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_match_users_matches_match_activities(open_matcher, seed):
+    matcher = _build(open_matcher, seed)
+    expected = {u["id"]: _ids(matcher.match_activities(u["id"])) for u in matcher.data["users"]}
+    assert {user["id"]: _ids(matched) for user, matched in matcher.match_all_users()} == expected
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_users_matching_activity_is_the_reverse_of_match_activities(open_matcher, seed):
+    matcher = _build(open_matcher, seed)
+    for activity in matcher.data["activities"]:
+        expected = [u["id"] for u in matcher.data["users"]
+                    if activity["id"] in _ids(matcher.match_activities(u["id"]))]
+        assert matcher.users_matching_activity(activity["id"]) == expected
+
+
+def test_vector_engine_sees_new_registrations(open_matcher):
+    matcher = open_matcher("json")
+    first = matcher.add_activity("上午", "环保活动", "东城区", "2026-01-05", "09:00-12:00", "")
+    matcher.add_activity("重叠", "环保活动", "东城区", "2026-01-05", "10:00-11:00", "")
+    user = matcher.register_user("志愿者", "东城区", ["环保活动"], ["周一"])
+    matcher.register_for_activity(user["id"], first["id"])
+    assert _ids(matcher.match_activities(user["id"])) == [first["id"]]
+    assert _ids(matcher.vector_engine().match(matcher.get_user(user["id"]))) == [first["id"]]
@@ -0,0 +1,54 @@
+"""报名时间冲突检测测试"""
+import json
+import random
+from datetime import datetime
+
+from matcher import Schedule
+
+
+def _activity(activity_id, time_range, participants=()):
+    # 这批改动之前的数据格式：没有 capacity、waitlist 和 version
+    return {"id": activity_id, "name": f"活动{activity_id}", "category": "环保活动", "location": "东城区",
+            "date": "2026-05-04", "time_range": time_range, "description": "",
+            "participants": list(participants)}
+
+
+def test_legacy_overlapping_registrations_still_block_conflicts(open_matcher, data_file):
+    data = {
+        "users": [{"id": 1, "name": "张三", "location": "东城区", "preferred_categories": ["环保活动"],
+                   "available_days": ["周一"], "registered_activities": [1, 2, 3]}],
+        "activities": [
+            _activity(1, "09:00-17:00", [1]),
+            _activity(2, "10:00-11:00", [1]),
+            _activity(3, "11:00-12:00", [1]),
+            _activity(4, "14:00-15:00"),
+            _activity(5, "17:00-18:00"),
+        ],
+    }
+    with open(data_file, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    matcher = open_matcher("json")
+
+    assert matcher.register_for_activity(1, 4) == "与已报名的活动时间冲突: 活动1"
+    assert [a["id"] for a in matcher.match_activities(1)] == [5]
+    assert matcher.register_for_activity(1, 5).startswith("成功")
+
+
+def test_find_overlap_matches_brute_force():
+    rng = random.Random(0)
+    base = datetime(2026, 5, 4)
+    schedule = Schedule()
+    entries = set()
+    for step in range(2000):
+        start = base.replace(hour=rng.randint(0, 20), minute=rng.choice([0, 30]))
+        end = start.replace(hour=start.hour + rng.randint(1, 3))
+        if entries and rng.random() < 0.3:
+            entry = rng.choice(sorted(entries))
+            schedule.remove(*entry)
+            entries.discard(entry)
+        else:
+            schedule.add(start, end, step)
+            entries.add((start, end, step))
+        overlapping = {aid for s, e, aid in entries if s < end and e > start and aid != step}
+        found = schedule.find_overlap(start, end, exclude=step)
+        assert (found in overlapping) if overlapping else found is None
@@ -0,0 +1,55 @@
+"""候补名单与递补测试"""
+
+
+def _setup(open_matcher, waiting):
+    """一个名额为 1 的活动，第一个用户已报名，其余用户按 (用户序号, 优先级) 依次加入候补"""
+    matcher = open_matcher()
+    matcher.add_activity("清理河道", "环保活动", "东城区", "2026-05-04", "09:00-12:00", "", capacity=1)
+    ids = [matcher.register_user(f"志愿者{i}", "东城区", ["环保活动"], ["周一"])["id"]
+           for i in range(len(waiting) + 1)]
+    assert matcher.register_for_activity(ids[0], 1).startswith("成功")
+    for user_id, priority in zip(ids[1:], waiting):
+        assert matcher.register_for_activity(user_id, 1, priority=priority) == "活动名额已满，已加入候补名单"
+    return matcher, ids
+
+
+def _participants(matcher):
+    return list(matcher.get_activity(1)["participants"])
+
+
+def test_promotes_by_priority_then_signup_order(open_matcher):
+    matcher, ids = _setup(open_matcher, [0, 5, 0, 5])
+    order = []
+    current = ids[0]
+    for _ in range(4):
+        matcher.cancel_registration(current, 1)
+        current, = _participants(matcher)
+        order.append(current)
+    assert order == [ids[2], ids[4], ids[1], ids[3]]
+    assert len(matcher.get_activity(1)["waitlist"]) == 0
+
+
+def test_leaving_waitlist_skips_user(open_matcher):
+    matcher, ids = _setup(open_matcher, [0, 0])
+    assert matcher.register_for_activity(ids[1], 1) == "你已在候补名单中"
+    assert matcher.cancel_registration(ids[1], 1)
+    matcher.cancel_registration(ids[0], 1)
+    assert _participants(matcher) == [ids[2]]
+
+
+def test_skips_waiting_user_with_schedule_conflict(open_matcher):
+    matcher, ids = _setup(open_matcher, [0, 0])
+    matcher.add_activity("课后辅导", "教育支持", "东城区", "2026-05-04", "10:00-11:00", "")
+    assert matcher.register_for_activity(ids[1], 2).startswith("成功")
+    matcher.cancel_registration(ids[0], 1)
+    assert _participants(matcher) == [ids[2]]
+    assert ids[1] not in matcher.get_activity(1)["waitlist"]
+
+
+def test_waitlist_survives_reload(open_matcher):
+    matcher, ids = _setup(open_matcher, [0, 3])
+    reloaded = open_matcher()
+    assert dict(reloaded.get_activity(1)["waitlist"]) == {ids[1]: 0, ids[2]: 3}
+    reloaded.cancel_registration(ids[0], 1)
+    assert _participants(reloaded) == [ids[2]]
+    assert _participants(open_matcher()) == [ids[2]]
@@ -0,0 +1,144 @@
+"""组提交与后台写入模式测试"""
+import gc
+import threading
+import weakref
+
+import pytest
+
+
+@pytest.mark.parametrize("backend", ["json", "journal", "sqlite"])
+def test_group_commit_acknowledges_after_flush(open_matcher, backend):
+    matcher = open_matcher(backend, flush_interval=60, flush_batch=1000)
+    matcher.add_activity("清理河道", "环保活动", "东城区", "2026-05-04", "09:00-12:00", "")
+    user = matcher.register_user("张三", "东城区", ["环保活动"], ["周一"])
+    durable = threading.Event()
+    assert matcher.register_for_activity(user["id"], 1, on_durable=durable.set).startswith("成功")
+    assert not durable.is_set()
+    assert open_matcher(backend).get_activity(1) is None
+
+    matcher.flush()
+    assert durable.is_set()
+    assert list(open_matcher(backend).get_activity(1)["participants"]) == [user["id"]]
+    # 自己写入的文件不应被当作外部修改而重新加载
+    assert not matcher.refresh()
+    matcher.close()
+
+
+@pytest.mark.parametrize("backend", ["json", "journal"])
+def test_group_commit_merges_writes_from_other_processes(open_matcher, backend):
+    first = open_matcher(backend, flush_interval=60, flush_batch=1000)
+    second = open_matcher(backend, flush_interval=60, flush_batch=1000)
+    first.add_activity("清理河道", "环保活动", "东城区", "2026-05-04", "", "")
+    first.flush()
+    second.refresh()
+    second.add_activity("陪伴老人", "关爱老人", "西城区", "2026-05-05", "", "")
+    first.add_activity("课后辅导", "教育支持", "东城区", "2026-05-06", "", "")
+    second.flush()
+    first.flush()
+    first.close()
+    second.close()
+    names = sorted(a["name"] for a in open_matcher(backend).data["activities"])
+    assert names == sorted(["清理河道", "陪伴老人", "课后辅导"])
+
+
+def _register_and_wait(matcher, user_id, activity_id):
+    """报名并返回 (报名结果, 落盘确认列表)，确认列表中 None 表示成功，字符串表示撤销原因"""
+    outcomes = []
+    result = matcher.register_for_activity(user_id, activity_id, on_durable=lambda: outcomes.append(None),
+                                           on_rejected=outcomes.append)
+    return result, outcomes
+
+
+@pytest.mark.parametrize("backend", ["json", "journal", "sqlite"])
+def test_group_commit_rechecks_capacity_against_other_processes(open_matcher, backend):
+    first = open_matcher(backend, flush_interval=60, flush_batch=1000)
+    first.add_activity("清理河道", "环保活动", "东城区", "2026-05-04", "09:00-12:00", "", capacity=1)
+    first_user = first.register_user("张三", "东城区", ["环保活动"], ["周一"])["id"]
+    second_user = first.register_user("李四", "东城区", ["环保活动"], ["周一"])["id"]
+    first.flush()
+    second = open_matcher(backend, flush_interval=60, flush_batch=1000)
+
+    # 两个进程都还没有看到对方尚未落盘的报名，各自认为还有名额
+    first_result, first_outcomes = _register_and_wait(first, first_user, 1)
+    second_result, second_outcomes = _register_and_wait(second, second_user, 1)
+    assert first_result.startswith("成功") and second_result.startswith("成功")
+    first.flush()
+    second.flush()
+
+    assert first_outcomes == [None]
+    assert second_outcomes == ["活动名额已满"]
+    assert list(open_matcher(backend).get_activity(1)["participants"]) == [first_user]
+    # 撤销之后第二个进程重新加载，看到的是磁盘上的真实结果
+    assert second.refresh()
+    assert list(second.get_activity(1)["participants"]) == [first_user]
+    assert len(second.get_user(second_user)["registered_activities"]) == 0
+    first.close()
+    second.close()
+
+
+@pytest.mark.parametrize("backend", ["json", "journal"])
+def test_group_commit_rechecks_schedule_conflicts(open_matcher, backend):
+    first = open_matcher(backend, flush_interval=60, flush_batch=1000)
+    first.add_activity("清理河道", "环保活动", "东城区", "2026-05-04", "09:00-12:00", "")
+    first.add_activity("课后辅导", "教育支持", "东城区", "2026-05-04", "11:00-13:00", "")
+    user = first.register_user("张三", "东城区", ["环保活动"], ["周一"])["id"]
+    first.flush()
+    second = open_matcher(backend, flush_interval=60, flush_batch=1000)
+
+    _, first_outcomes = _register_and_wait(first, user, 1)
+    _, second_outcomes = _register_and_wait(second, user, 2)
+    first.flush()
+    second.flush()
+
+    assert first_outcomes == [None]
+    assert second_outcomes == ["与已报名的活动时间冲突: 清理河道"]
+    assert list(open_matcher(backend).get_user(user)["registered_activities"]) == [1]
+    first.close()
+    second.close()
+
+
+@pytest.mark.parametrize("backend", ["json", "journal"])
+def test_background_writer_acknowledges_durable_writes(open_matcher, backend):
+    matcher = open_matcher(backend, background_writes=True)
+    matcher.add_activity("清理河道", "环保活动", "东城区", "2026-05-04", "09:00-12:00", "")
+    user = matcher.register_user("张三", "东城区", ["环保活动"], ["周一"])
+    durable = threading.Event()
+    matcher.register_for_activity(user["id"], 1, on_durable=durable.set)
+    assert durable.wait(5)
+    assert list(open_matcher(backend).get_activity(1)["participants"]) == [user["id"]]
+    matcher.close()
+
+
+@pytest.mark.parametrize("backend", ["json", "journal"])
+def test_background_writers_in_two_processes_lose_nothing(open_matcher, backend):
+    # max_pending 很小，写事务会频繁等待写线程（背压）
+    matchers = [open_matcher(backend, background_writes=True, max_pending=3) for _ in range(2)]
+
+    def add(matcher, prefix):
+        for i in range(30):
+            matcher.add_activity(f"{prefix}{i}", "环保活动", "东城区", "2026-05-04", "", "")
+
+    threads = [threading.Thread(target=add, args=(matcher, f"进程{n}-线程{t}-"))
+               for n, matcher in enumerate(matchers) for t in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for matcher in matchers:
+        matcher.close()
+
+    activities = open_matcher(backend).data["activities"]
+    assert len(activities) == 120
+    assert len({a["id"] for a in activities}) == 120
+
+
+@pytest.mark.parametrize("options", [{"flush_interval": 0.01}, {"background_writes": True}])
+def test_closed_storage_can_be_collected(open_matcher, options):
+    matcher = open_matcher("json", **options)
+    matcher.add_activity("清理河道", "环保活动", "东城区", "2026-05-04", "", "")
+    storage = weakref.ref(matcher.storage)
+    matcher.close()
+    del matcher
+    gc.collect()
+    assert storage() is None
+    assert open_matcher("json").count_activities() == 1